@@ -1,23 +1,83 @@
 # app.py
 # Main entry point for the FastAPI application with logging configuration.
+import asyncio
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 from fastapi import FastAPI
-from controllers import meeting_controller
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
 
 # Configure logging for the application.
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+# Handlers only enqueue records; a background listener thread formats and writes
+# them so request handlers never block on stderr I/O.
+log_queue = queue.SimpleQueue()
+stream_handler = logging.StreamHandler()
+stream_handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+root_logger = logging.getLogger()
+root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+root_logger.setLevel(logging.INFO)
+log_listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 logger.info("Starting My Meeting Bot application...")
 
-app = FastAPI(title="My Meeting Bot")
+# Imported after logging is configured so module-level basicConfig calls are no-ops.
+from controllers import meeting_controller
+from services import google_meet_bot
+from utils.display_manager import display_manager
+
+app = FastAPI(title="My Meeting Bot", default_response_class=ORJSONResponse)
 
 # Include the meeting controller routes in the main app.
 app.include_router(meeting_controller.router)
 
+@app.on_event("startup")
+async def init_cache():
+    """Initialize the in-process response cache used by the status/list endpoints."""
+    FastAPICache.init(InMemoryBackend())
+
+def _prewarm_chrome_pool():
+    try:
+        google_meet_bot.chrome_pool.prewarm()
+        logger.info("Chrome driver pool prewarmed.")
+    except Exception as e:
+        logger.warning(f"Could not prewarm Chrome driver pool: {str(e)}")
+
+@app.on_event("startup")
+async def prewarm_chrome():
+    """
+    Start the pooled Chrome drivers at boot so undetected-chromedriver's binary patching
+    and browser startup happen once here instead of on the first join request.
+    Runs on a worker thread so neither startup nor the event loop waits on the browsers.
+    """
+    asyncio.get_running_loop().run_in_executor(None, _prewarm_chrome_pool)
+
+def _prestart_display():
+    if display_manager.prestart():
+        logger.info("Shared Xvfb display started.")
+    else:
+        logger.warning("Could not start the shared Xvfb display; it will be retried on first use.")
+
+@app.on_event("startup")
+async def prestart_display():
+    """Start the shared Xvfb screen at boot, off the event loop; sessions then only claim a tile of it."""
+    asyncio.get_running_loop().run_in_executor(None, _prestart_display)
+
 # If running directly (e.g., python app.py), use uvicorn to launch the server.
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app:app", host="0.0.0.0", port=3000, reload=True)
+    # Sessions, drivers and recorder processes live in process memory, so only raise
+    # WEB_WORKERS above 1 once session state is shared across workers.
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=3000,
+        workers=int(os.getenv("WEB_WORKERS", "1")),
+        loop="uvloop",
+        http="httptools",
+    )
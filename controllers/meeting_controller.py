@@ -1,11 +1,15 @@
 # controllers/meeting_controller.py
 # Defines REST endpoints for joining a meeting, checking status, and leaving a meeting.
+import asyncio
 import logging
 import os
-import uuid
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, Path
-from typing import Dict, List, Optional
-from pydantic import BaseModel
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import APIRouter, HTTPException, Path, WebSocket, WebSocketDisconnect
+from typing import Literal
+from pydantic import BaseModel, HttpUrl
+from fastapi_cache import FastAPICache
+from fastapi_cache.decorator import cache
 
 from utils import session_store
 from services import google_meet_bot, zoom_bot
@@ -15,49 +19,79 @@ from services.meet_service import MeetService
 router = APIRouter(prefix="/api/meetings", tags=["meetings"])
 logger = logging.getLogger(__name__)
 
+# Cache namespaces for polled endpoints; cleared whenever a session is stopped or left.
+STATUS_CACHE_NAMESPACE = "status"
+MEETINGS_CACHE_NAMESPACE = "meetings"
+
+# Maps the platform name to the bot module that handles it.
+_PLATFORM_BOTS = {"google": google_meet_bot, "zoom": zoom_bot}
+
+# Joins block in Selenium for tens of seconds. They get their own executor, sized to the
+# Chrome cap, so they queue there instead of holding threads in the shared request threadpool.
+_join_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("CHROME_MAX_ACTIVE", "8")), thread_name_prefix="join"
+)
+
+def _report_join_failure(session_id: str):
+    """Done-callback for a join future: an exception that escaped the bot would otherwise vanish."""
+    def _callback(future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Join for session {session_id} failed: {error}", exc_info=error)
+            session_store.set_status(session_id, f"error: {str(error)}")
+    return _callback
+
+# Directories already created by ensure_dir, so repeat requests skip the syscalls.
+_ensured_dirs = set()
+
+def ensure_dir(path: str):
+    """Create the directory once per process; later calls for the same path are no-ops."""
+    if not path or path in _ensured_dirs:
+        return
+    os.makedirs(path, exist_ok=True)
+    _ensured_dirs.add(path)
+
+# Default recordings root, created at import so the common case never touches the filesystem per request.
+ensure_dir("recordings")
+
 # Pydantic models for request validation.
 class JoinRequest(BaseModel):
-    meetingUrl: str
-    platform: str  # "google" for Google Meet or "zoom" for Zoom
+    meetingUrl: HttpUrl
+    platform: Literal["google", "zoom"]  # "google" for Google Meet or "zoom" for Zoom
 
 class LeaveRequest(BaseModel):
     sessionId: str
 
 @router.post("/join")
-async def join_meeting(join_request: JoinRequest, background_tasks: BackgroundTasks):
+async def join_meeting(join_request: JoinRequest):
     """
     API endpoint to join a meeting.
-    Generates a unique sessionId and spawns a background task to start the Selenium session.
+    Generates a unique sessionId and queues the Selenium session on the join executor.
     """
-    session_id = str(uuid.uuid4())
+    session_id = secrets.token_hex(16)
     logger.info(f"Received join request for {join_request.platform} meeting: {join_request.meetingUrl}, session_id: {session_id}")
 
-    # Add session with initial "joining" status.
-    session_store.add_session(session_id, {"status": "joining", "driver": None, "platform": join_request.platform})
+    # Add session with initial "joining" status. With REDIS_URL set every store call is a
+    # blocking Redis round-trip, so async endpoints run them in a thread.
+    await asyncio.to_thread(
+        session_store.add_session, session_id,
+        {"status": "joining", "driver": None, "platform": join_request.platform}
+    )
     
-    try:
-        if join_request.platform.lower() == "google":
-            background_tasks.add_task(google_meet_bot.join_meeting, join_request.meetingUrl, session_id)
-        elif join_request.platform.lower() == "zoom":
-            background_tasks.add_task(zoom_bot.join_meeting, join_request.meetingUrl, session_id)
-        else:
-            session_store.remove_session(session_id)
-            logger.error(f"Unsupported platform requested: {join_request.platform}")
-            raise HTTPException(status_code=400, detail="Unsupported platform. Use 'google' or 'zoom'.")
-    except Exception as e:
-        logger.exception(f"Error processing join request: {str(e)}")
-        session_store.remove_session(session_id)
-        raise HTTPException(status_code=500, detail="Failed to process join request.")
+    bot = _PLATFORM_BOTS[join_request.platform]
+    future = _join_executor.submit(bot.join_meeting, str(join_request.meetingUrl), session_id)
+    future.add_done_callback(_report_join_failure(session_id))
 
     return {"sessionId": session_id, "status": "joining"}
 
 @router.get("/status/{session_id}")
+@cache(expire=1, namespace=STATUS_CACHE_NAMESPACE)
 async def get_status(session_id: str):
     """
     API endpoint to get the current status of a session.
     Returns whether the meeting session is joining, joined, or in an error state.
     """
-    session = session_store.get_session(session_id)
+    session = await asyncio.to_thread(session_store.get_session, session_id)
     if not session:
         logger.error(f"Status request for non-existent session: {session_id}")
         raise HTTPException(status_code=404, detail="Session not found")
@@ -65,31 +99,69 @@ async def get_status(session_id: str):
     logger.info(f"Status for session {session_id}: {session.get('status', 'unknown')}")
     return {"sessionId": session_id, "status": session.get("status", "unknown")}
 
+def _is_terminal_status(status: str) -> bool:
+    return status in ("joined", "left", "stopped") or status.startswith("error")
+
+@router.websocket("/ws/status/{session_id}")
+async def status_updates(websocket: WebSocket, session_id: str):
+    """
+    WebSocket endpoint that pushes status transitions for a session.
+    Sends the current status immediately, then each change until a terminal state, then closes.
+    """
+    await websocket.accept()
+    # Subscribe before reading the current status so no transition is missed in between.
+    status_queue = session_store.subscribe_status(session_id)
+    try:
+        session = await asyncio.to_thread(session_store.get_session, session_id)
+        if not session:
+            logger.error(f"Status subscription for non-existent session: {session_id}")
+            await websocket.send_json({"sessionId": session_id, "error": "Session not found"})
+            await websocket.close()
+            return
+
+        status = session.get("status", "unknown")
+        await websocket.send_json({"sessionId": session_id, "status": status})
+        while not _is_terminal_status(status):
+            status = await status_queue.get()
+            await websocket.send_json({"sessionId": session_id, "status": status})
+    except WebSocketDisconnect:
+        logger.info(f"Status subscriber for session {session_id} disconnected.")
+        return
+    finally:
+        session_store.unsubscribe_status(session_id, status_queue)
+    await websocket.close()
+
 @router.post("/leave")
 async def leave_meeting(leave_request: LeaveRequest):
     """
     API endpoint to leave a meeting.
     Closes the Selenium session associated with the given sessionId.
     """
-    session = session_store.get_session(leave_request.sessionId)
+    session = await asyncio.to_thread(session_store.get_session, leave_request.sessionId)
     if not session:
         logger.error(f"Leave request for non-existent session: {leave_request.sessionId}")
         raise HTTPException(status_code=404, detail="Session not found")
-    
+    if not session_store.is_owned_here(session):
+        # Its Chrome and recorder run in another worker; tearing down the shared record here
+        # would orphan them, so let the client retry until it reaches the owning worker.
+        logger.warning(f"Leave request for session {leave_request.sessionId} owned by {session.get('owner')}")
+        raise HTTPException(status_code=409, detail="Session is owned by another worker")
+
     platform = session.get("platform")
+    bot = _PLATFORM_BOTS.get(platform.lower()) if platform else None
+    if bot is None:
+        logger.error(f"Unsupported platform in session {leave_request.sessionId}: {platform}")
+        raise HTTPException(status_code=400, detail="Unsupported platform")
+
     try:
-        if platform.lower() == "google":
-            google_meet_bot.leave_meeting(leave_request.sessionId)
-        elif platform.lower() == "zoom":
-            zoom_bot.leave_meeting(leave_request.sessionId)
-        else:
-            logger.error(f"Unsupported platform in session {leave_request.sessionId}: {platform}")
-            raise HTTPException(status_code=400, detail="Unsupported platform")
+        # Selenium/ffmpeg teardown blocks for seconds; keep it off the event loop.
+        await asyncio.to_thread(bot.leave_meeting, leave_request.sessionId)
     except Exception as e:
         logger.exception(f"Error leaving meeting for session {leave_request.sessionId}: {str(e)}")
         raise HTTPException(status_code=500, detail="Error leaving meeting")
     
-    session_store.remove_session(leave_request.sessionId)
+    await asyncio.to_thread(session_store.remove_session, leave_request.sessionId)
+    await FastAPICache.clear(namespace=STATUS_CACHE_NAMESPACE)
     logger.info(f"Session {leave_request.sessionId} has been closed and removed.")
     return {"sessionId": leave_request.sessionId, "status": "left"}
 
@@ -98,7 +170,7 @@ async def start_meeting(request: MeetingRequest):
     """Start a new meeting recording session"""
     try:
         # Ensure the recording directory exists
-        os.makedirs(os.path.dirname(request.record_path), exist_ok=True)
+        ensure_dir(os.path.dirname(request.record_path))
         
         # Start the meeting
         session_id = MeetService.start_meeting(
@@ -121,10 +193,11 @@ async def start_meeting(request: MeetingRequest):
         raise HTTPException(status_code=500, detail=f"Failed to start meeting: {str(e)}")
 
 @router.get("/{session_id}", response_model=MeetingStatusResponse)
+@cache(expire=1, namespace=MEETINGS_CACHE_NAMESPACE)
 async def get_meeting_status(session_id: str = Path(..., description="Meeting session ID")):
     """Get the current status of a meeting session"""
     try:
-        status = MeetService.get_meeting_status(session_id)
+        status = await asyncio.to_thread(MeetService.get_meeting_status, session_id)
         
         if status.get("status") == "not_found":
             raise HTTPException(status_code=404, detail=f"Meeting session {session_id} not found")
@@ -147,13 +220,19 @@ async def get_meeting_status(session_id: str = Path(..., description="Meeting se
 async def stop_meeting(session_id: str = Path(..., description="Meeting session ID")):
     """Stop a meeting recording session"""
     try:
-        success = MeetService.stop_meeting(session_id)
+        session = await asyncio.to_thread(session_store.get_session, session_id)
+        if session and not session_store.is_owned_here(session):
+            # Only the owning worker holds the ffmpeg process that has to be told to stop.
+            raise HTTPException(status_code=409, detail=f"Meeting session {session_id} is owned by another worker")
+        success = await asyncio.to_thread(MeetService.stop_meeting, session_id)
         
         if not success:
             raise HTTPException(status_code=404, detail=f"Meeting session {session_id} not found or already stopped")
         
+        await FastAPICache.clear(namespace=MEETINGS_CACHE_NAMESPACE)
+        
         # Get updated status
-        status = MeetService.get_meeting_status(session_id)
+        status = await asyncio.to_thread(MeetService.get_meeting_status, session_id)
         
         return MeetingStatusResponse(
             session_id=session_id,
@@ -170,10 +249,11 @@ async def stop_meeting(session_id: str = Path(..., description="Meeting session
         raise HTTPException(status_code=500, detail=f"Failed to stop meeting: {str(e)}")
 
 @router.get("/", response_model=MeetingListResponse)
+@cache(expire=2, namespace=MEETINGS_CACHE_NAMESPACE)
 async def list_meetings():
     """List all active meeting sessions"""
     try:
-        meetings = MeetService.get_all_meetings()
+        meetings = await asyncio.to_thread(MeetService.get_all_meetings)
         
         # Convert to required format
         result = {}
@@ -18,4 +18,4 @@ fi
 
 # Start the API service
 echo "Starting Meeting Bot API service..."
-uvicorn app:app --host 0.0.0.0 --port 3000 --reload
+uvicorn app:app --host 0.0.0.0 --port 3000 --workers ${WEB_WORKERS:-1} --loop uvloop --http httptools
@@ -1,21 +1,64 @@
 import os
 import time
+import queue
+import functools
+import signal
+import selectors
 import logging
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import psutil
 import undetected_chromedriver as uc
 from selenium.common.exceptions import WebDriverException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 
-# Session store example (you can replace with your own implementation)
-session_store = {}
+from utils import session_store
+from utils.chromedriver_cache import patched_chromedriver
+from utils.chrome_profile import bot_chrome_options, ephemeral_profile_dir, remove_profile_dir
+from utils.process_wait import wait_for_exit
+from utils.pulse_audio import pulseaudio_running
+from utils.video_encoder import (
+    AUDIO_ENCODER_ARGS, PULSE_INPUT_ARGS, X11GRAB_INPUT_ARGS, pick_video_encoder, video_encoder_args
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Locators used while joining a meeting.
+_NAME_INPUT = (By.CSS_SELECTOR, 'input[placeholder="Your name"]')
+# Clicks the enabled "Ask to join" button in-page and returns whether it did, so each poll
+# of the join wait is one WebDriver round trip.
+_CLICK_ASK_TO_JOIN_SCRIPT = """
+for (const span of document.querySelectorAll('button span')) {
+    const button = span.closest('button');
+    if (span.textContent === 'Ask to join' && !button.disabled && button.offsetParent !== null) {
+        button.click();
+        return true;
+    }
+}
+return false;
+"""
+
 def get_session(session_id):
-    return session_store.setdefault(session_id, {})
+    session = session_store.get_session(session_id)
+    if session is None:
+        session = session_store.add_session(session_id)
+    return session
+
+def wait_for_display(display=":99", timeout=3.0) -> bool:
+    """
+    Poll for the X server lock file of the given display until it appears or the timeout elapses.
+    """
+    lock_file = f"/tmp/.X{display.lstrip(':')}-lock"
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(lock_file):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
 
 def start_virtual_display(display=":99", resolution="1280x720x24"):
     """
@@ -26,83 +69,328 @@ def start_virtual_display(display=":99", resolution="1280x720x24"):
     xvfb_cmd = ["Xvfb", display, "-screen", "0", resolution, "-nolisten", "unix"]
     try:
         xvfb_proc = subprocess.Popen(xvfb_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(2)  # Give time for Xvfb to initialize.
+        if not wait_for_display(display):
+            logger.warning(f"Xvfb on {display} did not report ready within the timeout.")
         logger.info(f"Xvfb virtual display started on {display} with resolution {resolution}.")
         return xvfb_proc
     except Exception as e:
         logger.exception(f"Failed to start virtual display (Xvfb): {str(e)}")
         return None
 
+# Set once PulseAudio is running with the null sink loaded; later joins skip setup entirely.
+_pulse_ready = False
+_pulse_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=1)
+def _null_sink_loaded() -> bool:
+    """Check once whether the Virtual_Sink null sink module is already loaded."""
+    try:
+        result = subprocess.run(
+            ["pactl", "list", "short", "modules"],
+            check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return False
+    return any(
+        "module-null-sink" in line and "sink_name=Virtual_Sink" in line
+        for line in result.stdout.splitlines()
+    )
+
 def setup_pulseaudio():
     """
     Start PulseAudio and load a null sink for virtual audio.
     """
-    try:
-        subprocess.run(["pulseaudio", "--start"], check=True)
-        logger.info("PulseAudio started (or already running).")
-    except subprocess.CalledProcessError as e:
-        logger.exception("Error starting PulseAudio.")
+    global _pulse_ready
+    with _pulse_lock:
+        if _pulse_ready:
+            return
 
-    try:
-        # Load the null sink (it may already be loaded)
-        subprocess.run(
-            ["pactl", "load-module", "module-null-sink", "sink_name=Virtual_Sink"],
-            check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        logger.info("PulseAudio null sink 'Virtual_Sink' loaded.")
-    except subprocess.CalledProcessError as e:
-        logger.warning("PulseAudio null sink may already be loaded.")
+        if pulseaudio_running():
+            logger.info("PulseAudio is already running.")
+        else:
+            try:
+                subprocess.run(["pulseaudio", "--start"], check=True)
+                logger.info("PulseAudio started.")
+            except subprocess.CalledProcessError as e:
+                logger.exception("Error starting PulseAudio.")
+                return
+
+        if _null_sink_loaded():
+            logger.info("PulseAudio null sink 'Virtual_Sink' already loaded.")
+            _pulse_ready = True
+            return
+
+        try:
+            subprocess.run(
+                ["pactl", "load-module", "module-null-sink", "sink_name=Virtual_Sink"],
+                check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            )
+            logger.info("PulseAudio null sink 'Virtual_Sink' loaded.")
+            _pulse_ready = True
+        except subprocess.CalledProcessError as e:
+            logger.warning("PulseAudio null sink may already be loaded.")
 
 def get_chrome_driver(user_data_dir: str):
-    options = uc.ChromeOptions()
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--remote-debugging-port=9222")
+    driver_path = patched_chromedriver()
+    options = bot_chrome_options(user_data_dir)
+    # Don't block driver.get() on the full load event; join_meeting's explicit waits gate progress.
+    options.page_load_strategy = "none"
+    # No fixed --remote-debugging-port: pooled browsers run side by side, and chromedriver
+    # picks a free port for each one when none is given.
     options.add_argument("--headless=new")
-    options.add_argument(f"--user-data-dir={user_data_dir}")
     options.binary_location = "/usr/bin/google-chrome"  # Adjust if needed.
 
     try:
-        driver = uc.Chrome(options=options)
+        driver = uc.Chrome(options=options, executable_path=driver_path)
         logger.info("Undetected Chrome driver started successfully for Google Meet.")
         return driver
     except Exception as e:
         logger.exception(f"Failed to start undetected Chrome driver: {str(e)}")
         raise
 
-def start_recording(session_id: str) -> subprocess.Popen:
+def call_with_deadline(func, timeout: float) -> bool:
+    """
+    Run func in a daemon thread and wait at most timeout seconds.
+    Returns True if it finished in time, False if it is still running.
+    """
+    worker = threading.Thread(target=func, daemon=True)
+    worker.start()
+    worker.join(timeout)
+    return not worker.is_alive()
+
+def kill_driver_processes(driver):
+    """
+    SIGKILL chromedriver and the Chrome browser behind the driver, including all their children.
+    """
+    pids = []
+    service_proc = getattr(getattr(driver, "service", None), "process", None)
+    if service_proc:
+        pids.append(service_proc.pid)
+    browser_pid = getattr(driver, "browser_pid", None)
+    if browser_pid:
+        pids.append(browser_pid)
+
+    for pid in pids:
+        try:
+            parent = psutil.Process(pid)
+            procs = parent.children(recursive=True) + [parent]
+        except psutil.NoSuchProcess:
+            continue
+        for proc in procs:
+            try:
+                proc.kill()
+            except psutil.NoSuchProcess:
+                pass
+        psutil.wait_procs(procs, timeout=3)
+
+def quit_driver(driver, timeout: float = 5.0):
+    """
+    Quit the driver gracefully, falling back to killing its processes if quit() hangs.
+    """
+    if not call_with_deadline(driver.quit, timeout):
+        logger.warning(f"driver.quit() did not finish within {timeout}s; killing Chrome processes.")
+        kill_driver_processes(driver)
+    remove_profile_dir(getattr(driver, "profile_dir", None))
+
+# Origins whose site data is wiped before a pooled driver is reused.
+_POOLED_ORIGINS = ("https://meet.google.com", "https://accounts.google.com")
+
+class ChromePool:
+    """
+    Bounded pool of idle Chrome drivers so joins reuse a running browser instead of
+    paying the undetected-chromedriver startup cost for every session.
+    At most max_active drivers are checked out at once; further joins wait for a free slot.
+    """
+    def __init__(self, size: int = 2, max_active: int = 8, acquire_timeout: float = 60.0):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.Queue(maxsize=size)
+        self._active = threading.BoundedSemaphore(max_active)
+
+    def _spawn(self):
+        user_data_dir = ephemeral_profile_dir()
+        try:
+            driver = get_chrome_driver(user_data_dir)
+        except Exception:
+            remove_profile_dir(user_data_dir)
+            raise
+        driver.profile_dir = user_data_dir
+        return driver
+
+    def prewarm(self):
+        """Fill the pool up to its capacity with freshly started drivers."""
+        while not self._idle.full():
+            try:
+                self._idle.put_nowait(self._spawn())
+            except queue.Full:
+                break
+
+    def acquire(self):
+        """Return an idle driver from the pool, or start a new one if none is available."""
+        if not self._active.acquire(timeout=self.acquire_timeout):
+            raise RuntimeError("Timed out waiting for a free Chrome driver slot")
+        try:
+            driver = self._idle.get_nowait()
+            logger.info("Reusing pooled Chrome driver.")
+            return driver
+        except queue.Empty:
+            pass
+        try:
+            return self._spawn()
+        except Exception:
+            self._active.release()
+            raise
+
+    def release(self, driver):
+        """Reset the driver's browsing state and return it to the pool, quitting it if the pool is full."""
+        # Free the slot first so a hung reset below cannot leak it.
+        self._active.release()
+        try:
+            driver.get("about:blank")
+            driver.delete_all_cookies()
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            # localStorage, IndexedDB and service workers would otherwise carry into the next session.
+            for origin in _POOLED_ORIGINS:
+                driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+            self._idle.put_nowait(driver)
+            logger.info("Returned Chrome driver to the pool.")
+        except queue.Full:
+            quit_driver(driver)
+        except Exception as e:
+            logger.warning(f"Discarding Chrome driver that could not be reset: {str(e)}")
+            quit_driver(driver)
+
+chrome_pool = ChromePool(
+    size=int(os.environ.get("CHROME_POOL_SIZE", "2")),
+    max_active=int(os.environ.get("CHROME_MAX_ACTIVE", "8")),
+)
+
+# Restarts allowed per session when ffmpeg dies or stops producing frames.
+MAX_RECORDING_RESTARTS = 3
+
+# Orders a watchdog restart against leave_meeting: leave sets the session's recording_stopping
+# flag and reads recording_proc under this lock, and the watchdog re-checks both under it
+# before starting a new ffmpeg, so a restart can't slip in after leave took the old process.
+_recording_lock = threading.Lock()
+
+def start_recording(session_id: str, attempt: int = 0) -> subprocess.Popen:
     """
     Start ffmpeg to capture the Xvfb display and audio from Virtual_Sink.monitor.
+    Restarted recordings (attempt > 0) go to a numbered file instead of overwriting the first.
     """
-    output_file = f"/home/arnav/media-recorder/{session_id}.mp4"
+    suffix = f"_{attempt}" if attempt else ""
+    output_file = f"/home/arnav/media-recorder/{session_id}{suffix}.mp4"
+    input_args, video_args = video_encoder_args(pick_video_encoder())
     ffmpeg_cmd = [
         "ffmpeg",
         "-y",
+        "-nostats", "-loglevel", "error",
+        "-progress", "pipe:1",
+        *input_args,
+        *X11GRAB_INPUT_ARGS,
         "-f", "x11grab",
+        "-draw_mouse", "0",
+        "-framerate", os.environ.get("RECORDING_FPS", "15"),
         "-s", "1280x720",
         "-i", os.environ.get("DISPLAY", ":99"),  # Use the DISPLAY variable (e.g., "localhost:99")
+        *PULSE_INPUT_ARGS,
         "-f", "pulse",
         "-i", "Virtual_Sink.monitor",
-        "-c:v", "libx264",
-        "-preset", "ultrafast",
-        "-c:a", "aac",
+        *video_args,
+        *AUDIO_ENCODER_ARGS,
+        # Fragmented MP4: no moov rewrite on stop, and the file stays playable if ffmpeg is killed.
+        "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+        "-frag_duration", "1000000",
         output_file
     ]
     try:
-        process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        process = subprocess.Popen(
+            ffmpeg_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
         logger.info(f"Started recording session {session_id} -> {output_file}")
+        # Stored before the watchdog starts so it recognises the process as the live recording.
+        session = session_store.get_session(session_id)
+        if session is not None:
+            session["recording_proc"] = process
+        threading.Thread(
+            target=watch_recording, args=(process, session_id, attempt), daemon=True
+        ).start()
         return process
     except Exception as e:
         logger.exception(f"Failed to start recording for session {session_id}: {str(e)}")
         return None
 
+def watch_recording(proc: subprocess.Popen, session_id: str, attempt: int,
+                    stall_timeout: float = 3.0, startup_timeout: float = 10.0):
+    """
+    Consume ffmpeg's -progress output (and its error log on the same pipe), restarting the
+    recording if ffmpeg exits or its frame counter stops advancing while it is still wanted.
+    """
+    last_frame = None
+    deadline = time.monotonic() + startup_timeout
+    stalled = False
+    with selectors.DefaultSelector() as selector:
+        selector.register(proc.stdout, selectors.EVENT_READ)
+        while True:
+            if selector.select(timeout=max(0.0, deadline - time.monotonic())):
+                line = proc.stdout.readline()
+                if not line:
+                    break  # ffmpeg exited
+                line = line.decode(errors="replace").strip()
+                if line.startswith("frame="):
+                    if line != last_frame:
+                        last_frame = line
+                        deadline = time.monotonic() + stall_timeout
+                elif "=" not in line:
+                    logger.error(f"ffmpeg [{session_id}]: {line}")
+            if time.monotonic() >= deadline:
+                stalled = True
+                break
+
+    if getattr(proc, "stopping", False):
+        return
+    session = session_store.get_session(session_id)
+    if session is None or session.get("recording_proc") is not proc:
+        return
+    if stalled:
+        logger.error(f"ffmpeg for session {session_id} stopped producing frames; restarting it.")
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    else:
+        logger.error(f"ffmpeg for session {session_id} exited unexpectedly with code {proc.wait()}; restarting it.")
+    proc.wait()
+    if attempt >= MAX_RECORDING_RESTARTS:
+        logger.error(f"Giving up on recording session {session_id} after {attempt} restarts.")
+        return
+    with _recording_lock:
+        if session.get("recording_stopping") or session.get("recording_proc") is not proc:
+            return
+        start_recording(session_id, attempt + 1)
+
 def stop_recording(proc: subprocess.Popen, session_id: str):
     if not proc:
         return
+    # Tells the watchdog this exit is intended so it doesn't restart ffmpeg.
+    proc.stopping = True
     try:
-        proc.terminate()
-        proc.wait(timeout=10)
+        # "q" asks ffmpeg to stop cleanly; with fragmented output there is no trailer to wait on.
+        try:
+            proc.stdin.write(b"q\n")
+            proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            pass
+        if not wait_for_exit(proc, 2):
+            logger.warning(f"ffmpeg did not exit on 'q' for session {session_id}; killing it.")
+            try:
+                # ffmpeg runs in its own session, so this takes down any helpers it spawned too.
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        proc.wait()
         logger.info(f"Stopped recording session {session_id}")
     except Exception as e:
         logger.exception(f"Failed to stop recording session {session_id}: {str(e)}")
@@ -113,53 +401,51 @@ def join_meeting(meeting_url: str, session_id: str):
     """
     logger.info(f"Starting Google Meet session for {meeting_url} with session_id: {session_id}")
 
-    # Start Xvfb with -nolisten unix and set DISPLAY accordingly.
-    xvfb_proc = start_virtual_display(display=":99", resolution="1280x720x24")
-
-    # Set up PulseAudio with a null sink.
-    setup_pulseaudio()
+    # Start Xvfb (with -nolisten unix, setting DISPLAY accordingly) and the PulseAudio
+    # null sink concurrently; they are independent, so setup takes the longer of the two.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        xvfb_future = executor.submit(start_virtual_display, display=":99", resolution="1280x720x24")
+        pulse_future = executor.submit(setup_pulseaudio)
+        xvfb_proc = xvfb_future.result()
+        pulse_future.result()
 
     try:
-        user_data_dir = f"/tmp/chrome_user_data_{session_id}"
-        os.makedirs(user_data_dir, exist_ok=True)
-        driver = get_chrome_driver(user_data_dir)
+        driver = chrome_pool.acquire()
         session = get_session(session_id)
         session["driver"] = driver
         session["xvfb_proc"] = xvfb_proc
+        session["recording_stopping"] = False
 
         # Start ffmpeg recording.
-        recording_proc = start_recording(session_id)
-        session["recording_proc"] = recording_proc
+        # start_recording stores the process on the session (and replaces it on restart).
+        start_recording(session_id)
 
         # Navigate to the meeting URL.
         driver.get(meeting_url)
         logger.info(f"Navigated to Google Meet URL: {meeting_url}")
-        time.sleep(5)  # Allow page to load.
 
         try:
-            wait = WebDriverWait(driver, 15)
-            name_input = wait.until(EC.presence_of_element_located((By.XPATH, '//input[@placeholder="Your name"]')))
+            # The explicit wait below is the only synchronization point for page load.
+            wait = WebDriverWait(driver, 20, poll_frequency=0.1)
+            name_input = wait.until(EC.presence_of_element_located(_NAME_INPUT))
             name_input.clear()
             name_input.send_keys("Oracia")
             logger.info("Entered the display name: Oracia")
 
-            ask_to_join_button = wait.until(EC.element_to_be_clickable((By.XPATH, '//span[text()="Ask to join"]/ancestor::button[1]')))
-            ask_to_join_button.click()
+            wait.until(lambda d: d.execute_script(_CLICK_ASK_TO_JOIN_SCRIPT))
             logger.info("Clicked the 'Ask to join' button.")
         except TimeoutException:
             logger.warning("Name input or 'Ask to join' button not found in time.")
 
-        session["status"] = "joined"
+        session_store.set_status(session_id, "joined")
         logger.info(f"Session {session_id} successfully joined Google Meet.")
 
     except WebDriverException as e:
         logger.exception(f"WebDriverException in Google Meet session {session_id}: {str(e)}")
-        session = get_session(session_id)
-        session["status"] = f"error: {str(e)}"
+        session_store.set_status(session_id, f"error: {str(e)}")
     except Exception as e:
         logger.exception(f"Unexpected error in Google Meet session {session_id}: {str(e)}")
-        session = get_session(session_id)
-        session["status"] = f"error: {str(e)}"
+        session_store.set_status(session_id, f"error: {str(e)}")
 
 def leave_meeting(session_id: str):
     """
@@ -170,12 +456,18 @@ def leave_meeting(session_id: str):
     driver = session.get("driver")
     if driver:
         try:
-            driver.quit()
+            if not call_with_deadline(lambda: chrome_pool.release(driver), 5):
+                logger.warning(f"Releasing Chrome for session {session_id} timed out; killing it.")
+                kill_driver_processes(driver)
+                remove_profile_dir(getattr(driver, "profile_dir", None))
+            session["driver"] = None
             logger.info(f"Session {session_id} closed successfully.")
         except Exception as e:
             logger.exception(f"Error closing session {session_id}: {str(e)}")
 
-    recording_proc = session.get("recording_proc")
+    with _recording_lock:
+        session["recording_stopping"] = True
+        recording_proc = session.get("recording_proc")
     if recording_proc:
         stop_recording(recording_proc, session_id)
 
@@ -183,12 +475,15 @@ def leave_meeting(session_id: str):
     if xvfb_proc:
         try:
             xvfb_proc.terminate()
-            xvfb_proc.wait(timeout=10)
+            try:
+                xvfb_proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                xvfb_proc.kill()
             logger.info("Xvfb virtual display stopped.")
         except Exception as e:
             logger.exception(f"Error stopping Xvfb process: {str(e)}")
 
-    session["status"] = "left"
+    session_store.set_status(session_id, "left")
 
 # # Example usage:
 # if __name__ == "__main__":
@@ -1,29 +1,267 @@
 import os
+import re
+import base64
+import fcntl
 import time
+import signal
 import logging
 import subprocess
 import threading
 import sys
 import requests  # Add this import for HTTP requests
-import psutil
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Optional
 
 import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
 from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
 # --- New imports for HTTP endpoint ---
-from flask import Flask, request, jsonify
+from flask import Flask, jsonify
+
+# Allow running this file directly as a script while importing shared helpers from utils/.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.video_encoder import (
+    AUDIO_ENCODER_ARGS, ENCODER_THREADS, PULSE_INPUT_ARGS, X11GRAB_INPUT_ARGS, log_ffmpeg_stderr, pick_video_encoder,
+    video_encoder_args
+)
+from utils.chromedriver_cache import patched_chromedriver
+from utils.chrome_profile import MEET_CHROME_ARGS, bot_chrome_options
+from utils.meet_scripts import CLICK_JOIN_SCRIPT, enter_guest_name, install_popup_dismisser
+from utils.pulse_audio import pulseaudio_running
 
 # --- Global variable for cleanup ---
 already_stopped = False
+# Set when the recording is made in-browser by MediaRecorder (headless mode) instead of FFmpeg.
+browser_recording = False
+# Live upload of FFmpeg's output while recording (STREAM_UPLOAD); stopScript only falls back
+# to uploading the file if it did not complete.
+stream_upload_thread = None
+stream_upload_ok = False
+# Signed upload URL fetched while Chrome joins, so a dead upload endpoint stops the bot before
+# it records anything and stopping doesn't wait on the request. Signed URLs expire, so
+# upload_recording only reuses it while it is younger than cfg.signed_url_max_age.
+signed_url_prefetch = Future()
+prefetched_signed_url = None
+prefetched_at = 0.0
+
+# --- In-browser recording used in headless mode ---
+# Records the current tab with getDisplayMedia + MediaRecorder, so Chrome's own encoder
+# produces the WebM and no screen grab or re-encode is needed. Chunks queue up in the page and
+# are pulled over WebDriver: a fetch from meet.google.com to a local endpoint would run into
+# mixed-content, Private Network Access and CSP blocking.
+BROWSER_RECORDER_START_SCRIPT = """
+const done = arguments[arguments.length - 1];
+(async () => {
+    const stream = await navigator.mediaDevices.getDisplayMedia({
+        video: { frameRate: 25 }, audio: true, preferCurrentTab: true
+    });
+    const recorder = new MediaRecorder(stream, { mimeType: 'video/webm; codecs=vp9,opus' });
+    window.__recordedChunks = [];
+    recorder.ondataavailable = (event) => {
+        if (event.data.size > 0) window.__recordedChunks.push(event.data);
+    };
+    recorder.start(1000);
+    window.__meetRecorder = recorder;
+    done(true);
+})().catch((error) => done(String(error)));
+"""
+
+# Hands the chunks recorded since the last call back as base64 (WebDriver only carries strings),
+# "" when there are none, or null on failure, in which case the chunks stay queued for the next pull.
+BROWSER_RECORDER_DRAIN_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const chunks = window.__recordedChunks || [];
+window.__recordedChunks = [];
+if (chunks.length === 0) { done(''); return; }
+const reader = new FileReader();
+reader.onload = () => done(reader.result.slice(reader.result.indexOf(',') + 1));
+reader.onerror = () => {
+    window.__recordedChunks = chunks.concat(window.__recordedChunks);
+    done(null);
+};
+reader.readAsDataURL(new Blob(chunks));
+"""
+
+# Resolves once the recorder's final dataavailable has fired, so one more drain collects it all.
+BROWSER_RECORDER_STOP_SCRIPT = """
+const done = arguments[arguments.length - 1];
+const recorder = window.__meetRecorder;
+if (!recorder || recorder.state === 'inactive') { done(false); return; }
+recorder.addEventListener('stop', () => done(true), { once: true });
+recorder.stop();
+"""
+
+# Seconds between pulls of recorded chunks out of the page.
+CHUNK_DRAIN_INTERVAL = float(os.environ.get("CHUNK_DRAIN_INTERVAL", "5"))
+browser_drain_stop = threading.Event()
+browser_drain_thread = None
+
+def drain_browser_chunks():
+    """Append the chunks recorded since the last drain to the record file."""
+    data = driver.execute_async_script(BROWSER_RECORDER_DRAIN_SCRIPT)
+    if data is None:
+        raise RuntimeError("the page could not read its recorded chunks")
+    if data:
+        with open(record_path, "ab") as f:
+            f.write(base64.b64decode(data))
+
+def drain_browser_recording():
+    """Keep pulling recorded chunks to disk until the recording is stopped."""
+    while not browser_drain_stop.wait(CHUNK_DRAIN_INTERVAL):
+        try:
+            drain_browser_chunks()
+        except Exception as e:
+            logging.error(f"Could not pull recorded chunks from the page: {e}")
+
+def stop_browser_recording():
+    """Stop the in-page MediaRecorder and write out every chunk it still holds."""
+    browser_drain_stop.set()
+    if browser_drain_thread:
+        browser_drain_thread.join()
+    try:
+        driver.set_script_timeout(30)
+        if not driver.execute_async_script(BROWSER_RECORDER_STOP_SCRIPT):
+            logging.warning("No active browser recording to stop.")
+        drain_browser_chunks()
+        logging.info("Browser recording stopped and flushed.")
+    except Exception as e:
+        logging.error(f"Could not collect the end of the browser recording; it may be truncated: {e}")
+
+UPLOAD_SERVER_URL = "https://rw.debatesacademy.com"
+
+def upload_session(max_retries=None) -> requests.Session:
+    """
+    One keep-alive connection serves both the signed-URL request and the upload. Transient
+    gateway errors are retried with backoff (urllib3 rewinds file bodies) rather than losing
+    the whole recording; pass max_retries=0 for bodies that can't be rewound.
+    """
+    if max_retries is None:
+        max_retries = Retry(total=5, backoff_factor=1, status_forcelist=[502, 503, 504], allowed_methods=["POST", "PUT"])
+    http = requests.Session()
+    http.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=max_retries))
+    return http
+
+def request_signed_url(http: requests.Session) -> str:
+    """Ask the recording worker for a signed URL to PUT this session's recording to."""
+    logging.info(f"Requesting upload URL from {UPLOAD_SERVER_URL} with session ID: {cfg.session_id}")
+    response = http.post(
+        f"{UPLOAD_SERVER_URL}/recording-worker/record/upload-video",
+        json={"sessionId":cfg.session_id}
+    )
+    response.raise_for_status()  # Raise an exception for HTTP errors
+    signed_url = response.json().get("signedUrl")
+    logging.info(f"Received signed URL {signed_url}")
+    return signed_url
+
+def prefetch_signed_url():
+    """Fetch the signed upload URL into signed_url_prefetch; run in a thread at startup."""
+    global prefetched_signed_url, prefetched_at
+    try:
+        signed_url = request_signed_url(upload_session())
+        if not signed_url:
+            raise RuntimeError("The recording worker returned no signed URL")
+        prefetched_signed_url, prefetched_at = signed_url, time.monotonic()
+        signed_url_prefetch.set_result(signed_url)
+    except Exception as e:
+        signed_url_prefetch.set_exception(e)
+
+def upload_url(http: requests.Session) -> str:
+    """Return the prefetched signed URL while it is still fresh, otherwise request a new one."""
+    if prefetched_signed_url and time.monotonic() - prefetched_at < cfg.signed_url_max_age:
+        return prefetched_signed_url
+    return request_signed_url(http)
+
+def upload_recording(attempts=2):
+    """
+    Upload the finished recording to the recording worker via a signed URL.
+    The first attempt reuses the prefetched URL if it hasn't aged out; a retry always asks for
+    a fresh one, since an expired URL is the likeliest reason the PUT was rejected.
+    """
+    try:
+        http = upload_session()
+        content_type = "video/webm" if record_path.endswith(".webm") else "video/mp4"
+
+        def put(url):
+            # Passing the file object makes requests stream it instead of loading the whole recording.
+            with open(record_path, "rb") as video_file:
+                return http.put(
+                    url,
+                    data=video_file,
+                    headers={
+                        "Content-Type": content_type,
+                        "Content-Length": str(os.path.getsize(record_path))
+                    }
+                )
+
+        for attempt in range(1, attempts + 1):
+            try:
+                upload_response = put(upload_url(http) if attempt == 1 else request_signed_url(http))
+                upload_response.raise_for_status()
+                break
+            except requests.exceptions.RequestException as e:
+                # Any failure (rejected URL, reset connection, exhausted retries) gets a fresh URL.
+                if attempt == attempts:
+                    raise
+                logging.warning(f"Upload attempt {attempt} failed; retrying with a fresh upload URL: {e}")
+        
+        logging.info(f"Successfully uploaded recording to {UPLOAD_SERVER_URL}")
+        
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Error during upload: {e}")
+    except IOError as e:
+        logging.error(f"Error reading video file: {e}")
+    except Exception as e:
+        logging.error(f"Unexpected error during upload: {e}")
+
+def stream_recording_upload(stream, signed_url):
+    """PUT FFmpeg's fragmented MP4 output to the signed URL with chunked encoding as it is produced."""
+    global stream_upload_ok
+    try:
+        # A generator body can't be rewound, so this upload is not retried.
+        upload_response = upload_session(max_retries=0).put(
+            signed_url,
+            data=iter(lambda: stream.read(1 << 20), b""),
+            headers={"Content-Type": "video/mp4"}
+        )
+        upload_response.raise_for_status()
+        stream_upload_ok = True
+        logging.info(f"Successfully streamed recording to {UPLOAD_SERVER_URL}")
+    except Exception as e:
+        logging.error(f"Streaming upload failed; the file will be uploaded after recording: {e}")
+    finally:
+        # Keep reading so FFmpeg never blocks on a full pipe after a failed upload.
+        for _ in iter(lambda: stream.read(1 << 20), b""):
+            pass
+
+def transcode_recording():
+    """Compress the lossless capture into the final recording file, then delete the capture."""
+    if capture_path == record_path or not os.path.exists(capture_path):
+        return
+    transcode_cmd = [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-i", capture_path,
+        "-c:v", "libx264", "-preset", "slow", "-crf", "23", "-pix_fmt", "yuv420p",
+        "-threads", str(ENCODER_THREADS),
+        *AUDIO_ENCODER_ARGS,
+        "-movflags", "+faststart",
+        record_path
+    ]
+    logging.info(f"Transcoding {capture_path} -> {record_path}...")
+    try:
+        subprocess.run(transcode_cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        os.remove(capture_path)
+        logging.info("Transcoding finished.")
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Transcoding failed: {e.stderr.decode().strip()}")
 
 # --- Define cleanup function before its usage in the HTTP endpoint ---
 def stopScript():
     """
-    Cleanup function to stop FFmpeg, close Chrome, and kill Xvfb.
+    Cleanup function to stop the recording, upload it, close Chrome, and kill Xvfb.
     This function is called when a stop signal is received.
     """
     global already_stopped
@@ -44,48 +282,18 @@ def stopScript():
             logging.info("FFmpeg stopped gracefully in stopScript.")
             
             # After successful recording completion, upload the video
-            try:
-                # Get the upload server URL from environment or use a default
-                upload_server_url = "https://rw.debatesacademy.com"
-                session_id = os.environ.get("SESSION_ID", "default-session")
-                
-                logging.info(f"Uploading recording to {upload_server_url} with session ID: {session_id}")
-                
-                # Step 1: Get a signed URL for upload
-                response = requests.post(
-                    f"{upload_server_url}/recording-worker/record/upload-video",
-                    json={"sessionId":session_id}
-                    
-                )
-                response.raise_for_status()  # Raise an exception for HTTP errors
-                
-                upload_data = response.json()
-                signed_url = upload_data.get("signedUrl")
-                
-                logging.info(f"Received signed URL {signed_url}")
-                
-                # Step 2: Upload the video file using the signed URL
-                with open(record_path, "rb") as video_file:
-                    video_data = video_file.read()
-                    upload_response = requests.put(
-                        signed_url,
-                        data=video_data,
-                        headers={"Content-Type": "video/mp4"}
-                    )
-                    upload_response.raise_for_status()
-                
-                logging.info(f"Successfully uploaded recording to {upload_server_url}")
-                
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Error during upload: {e}")
-            except IOError as e:
-                logging.error(f"Error reading video file: {e}")
-            except Exception as e:
-                logging.error(f"Unexpected error during upload: {e}")
+            if stream_upload_thread:
+                stream_upload_thread.join()
+            transcode_recording()
+            if not stream_upload_ok:
+                upload_recording()
                 
         except Exception as e:
             logging.warning(f"FFmpeg did not stop gracefully in stopScript: {e}")
             ffmpeg_process.kill()
+    elif browser_recording:
+        stop_browser_recording()
+        upload_recording()
     
     # Continue with the original cleanup
     if driver:
@@ -99,98 +307,126 @@ def stopScript():
 app = Flask(__name__)
 stop_event = threading.Event()
 
+def _stop_in_background():
+    try:
+        stopScript()
+    finally:
+        stop_event.set()  # Signal main loop to exit
+
 @app.route('/internal_stop', methods=['POST'])
 def internal_stop():
-    global already_stopped
     logging.info("Received internal stop request via HTTP endpoint.")
-    if not already_stopped:
-        stopScript()  # Call the cleanup function
-    stop_event.set()  # Signal main loop to exit
-    return jsonify({"message": "Stop signal processed."}), 200
+    if already_stopped:
+        stop_event.set()
+    else:
+        # Stopping includes transcoding and a multi-GB upload; don't hold the request open for it.
+        threading.Thread(target=_stop_in_background, name="stop-script").start()
+    return jsonify({"message": "Stop signal accepted."}), 202
 
 def run_flask():
-    # Run the Flask app; debug is off and use_reloader is disabled for thread safety.
-    app.run(host="0.0.0.0", port=5001, debug=False, use_reloader=False)
+    # Serve the Flask app from waitress: a fixed pool of worker threads instead of a new
+    # Werkzeug thread for every request and health probe.
+    from waitress import serve
+    serve(app, host="0.0.0.0", port=5001, threads=2, _quiet=True)
 
 # --- Existing configuration and setup ---
-def handle_popups(driver, logger=None, timeout=3):
-    """
-    Looks for common pop-ups or info boxes in Google Meet
-    and dismisses them if present. Adjust XPaths or text as needed.
-    """
-    if logger is None:
-        import logging
-        logger = logging.getLogger(__name__)
-
-    popup_selectors = [
-        ('//span[text()="Got it"]', 'Got it'),
-        ('//span[text()="Continue without microphone and camera"]', 'Continue without microphone and camera'),
-        ('//span[text()="Continue without microphone"]', 'Continue without microphone'),
-    ]
-
-    for xpath, desc in popup_selectors:
-        try:
-            if WebDriverWait(driver, timeout).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            ):
-                elem = driver.find_element(By.XPATH, xpath)
-                elem.click()
-                logger.info(f"Dismissed/Clicked '{desc}' popup.")
-                time.sleep(0.5)
-        except (NoSuchElementException, TimeoutException):
-            pass
-        except Exception as e:
-            logger.warning(f"Could not dismiss '{desc}' popup: {e}")
-
-def periodic_popup_handler(driver, logger):
+def log_dismissed_popups(driver, logger, interval=5):
+    """Periodically log the popups the in-page dismisser has clicked."""
     while True:
         try:
-            handle_popups(driver, logger=logger, timeout=2)
-            time.sleep(5)  # check every 5 seconds
+            dismissed = driver.execute_script(
+                "const d = window.__dismissedPopups || []; window.__dismissedPopups = []; return d;"
+            )
+            for desc in dismissed:
+                logger.info(f"Dismissed/Clicked '{desc}' popup.")
+            time.sleep(interval)
         except Exception as e:
-            logger.warning(f"Popup handler encountered an error: {e}")
+            logger.warning(f"Popup logger encountered an error: {e}")
             break
 
-# --- Configuration from environment variables ---
-meet_link = os.environ.get("GMEET_LINK")
-if not meet_link:
-    raise RuntimeError("GMEET_LINK environment variable must be set to the Google Meet URL.")
-
-record_path = os.environ.get("RECORDING_PATH", "recordings/output.mp4")
-display_num = os.environ.get("DISPLAY_NUM", "99")
-screen_res = os.environ.get("SCREEN_RESOLUTION", "1280x720")
-screen_depth = os.environ.get("SCREEN_DEPTH", "24")
-display_name = os.environ.get("DISPLAY_NAME", "Oracia")
-
-chrome_path = os.environ.get("CHROME_BINARY")
-user_data_dir = os.environ.get("CHROME_USER_DATA_DIR", "/tmp/meet_bot_profile")
-
-show_browser = True
-no_xvfb = False
-
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
+
+# --- Configuration from environment variables ---
+_RESOLUTION_RE = re.compile(r"(\d+)x(\d+)")
+
+@dataclass(frozen=True, slots=True)
+class RecorderConfig:
+    """Recorder settings, read and validated once from the environment."""
+    meet_link: str
+    record_path: str = "recordings/output.mp4"
+    display_num: str = "99"
+    width: int = 1280
+    height: int = 720
+    depth: int = 24
+    display_name: str = "Oracia"
+    # 15 fps is plenty for slide/document meetings and halves encoder work.
+    recording_fps: int = 15
+    # Capture a lossless intermediate during the meeting and compress it once recording stops,
+    # keeping the expensive encode off the realtime path at the cost of temporary disk space.
+    offline_transcode: bool = False
+    # Upload the fragmented MP4 while it is recorded instead of after stop. Needs an upload
+    # link that keeps up with the encode bitrate, or FFmpeg stalls on the pipe.
+    stream_upload: bool = False
+    chrome_path: Optional[str] = None
+    user_data_dir: str = "/tmp/meet_bot_profile"
+    show_browser: bool = True
+    no_xvfb: bool = False
+    session_id: str = "default-session"
+    pulse_server: Optional[str] = None
+    # Reuse the signed URL fetched at startup for uploads only while it is younger than this
+    # many seconds; keep it below the worker's signed-URL lifetime.
+    signed_url_max_age: int = 600
+
+    @classmethod
+    def from_env(cls, env=os.environ) -> "RecorderConfig":
+        meet_link = env.get("GMEET_LINK")
+        if not meet_link:
+            raise RuntimeError("GMEET_LINK environment variable must be set to the Google Meet URL.")
+
+        match = _RESOLUTION_RE.fullmatch(env.get("SCREEN_RESOLUTION", "1280x720"))
+        if match:
+            width, height = int(match[1]), int(match[2])
+        else:
+            logger.warning("Invalid SCREEN_RESOLUTION format. Falling back to 1280x720.")
+            width, height = 1280, 720
+        screen_depth = env.get("SCREEN_DEPTH", "24")
+        depth = int(screen_depth) if screen_depth.isdigit() else 24
+
+        return cls(
+            meet_link=meet_link,
+            record_path=env.get("RECORDING_PATH", "recordings/output.mp4"),
+            display_num=env.get("DISPLAY_NUM", "99"),
+            width=width,
+            height=height,
+            depth=depth,
+            display_name=env.get("DISPLAY_NAME", "Oracia"),
+            recording_fps=int(env.get("RECORDING_FPS", "15")),
+            offline_transcode=env.get("OFFLINE_TRANSCODE", "false").lower() == "true",
+            stream_upload=env.get("STREAM_UPLOAD", "false").lower() == "true",
+            chrome_path=env.get("CHROME_BINARY"),
+            user_data_dir=env.get("CHROME_USER_DATA_DIR", "/tmp/meet_bot_profile"),
+            show_browser=env.get("SHOW_BROWSER", "true").lower() != "false",
+            session_id=env.get("SESSION_ID", "default-session"),
+            pulse_server=env.get("PULSE_SERVER"),
+            signed_url_max_age=int(env.get("SIGNED_URL_MAX_AGE", "600")),
+        )
+
+cfg = RecorderConfig.from_env()
+# The output path changes extension in headless mode, so it lives outside the frozen config.
+record_path = cfg.record_path
+
 logger.info("Starting Google Meet recorder bot...")
 
 os.makedirs(os.path.dirname(record_path), exist_ok=True)
 
-try:
-    width, height = map(int, screen_res.split('x'))
-except Exception as e:
-    logger.warning("Invalid SCREEN_RESOLUTION format. Falling back to 1280x720.")
-    width, height = 1280, 720
-try:
-    depth = int(screen_depth)
-except:
-    depth = 24
-
 # --- Start Xvfb only if NO_XVFB is not set ---
 xvfb_proc = None
-if not no_xvfb:
-    display_env = f":{display_num}"
-    xvfb_cmd = ["Xvfb", display_env, "-screen", "0", f"{width}x{height}x{depth}", "-ac"]
+if not cfg.no_xvfb:
+    display_env = f":{cfg.display_num}"
+    xvfb_cmd = ["Xvfb", display_env, "-screen", "0", f"{cfg.width}x{cfg.height}x{cfg.depth}", "-ac"]
     try:
-        logger.info(f"Launching Xvfb on display {display_env} with resolution {width}x{height}x{depth}...")
+        logger.info(f"Launching Xvfb on display {display_env} with resolution {cfg.width}x{cfg.height}x{cfg.depth}...")
         xvfb_proc = subprocess.Popen(xvfb_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         time.sleep(1)
         if xvfb_proc.poll() is not None:
@@ -206,72 +442,73 @@ else:
     logger.info("NO_XVFB is set; skipping Xvfb startup.")
 
 # --- Start PulseAudio (for audio capture) ---
-pulse_server = os.environ.get("PULSE_SERVER")
-if pulse_server:
-    logger.info(f"Using external PulseAudio server at {pulse_server}.")
+if cfg.pulse_server:
+    logger.info(f"Using external PulseAudio server at {cfg.pulse_server}.")
 else:
-    try:
-        subprocess.run(["pulseaudio", "--check"], check=True)
+    if pulseaudio_running():
         logger.info("PulseAudio is already running.")
-    except subprocess.CalledProcessError:
+    else:
         try:
             subprocess.run(["pulseaudio", "--start"], check=True)
             logger.info("PulseAudio daemon started.")
         except subprocess.CalledProcessError as e:
             logger.error(f"Failed to start PulseAudio: {e}")
 
+# --- Fetch the upload URL while Chrome starts and joins ---
+threading.Thread(target=prefetch_signed_url, name="prefetch-upload-url", daemon=True).start()
+
 # --- Launch undetected Chrome via Selenium ---
-options = uc.ChromeOptions()
-if chrome_path:
-    options.binary_location = chrome_path
-
-options.add_argument("--disable-gpu")
-options.add_argument("--no-sandbox")
-options.add_argument("--disable-dev-shm-usage")
-options.add_argument("--no-first-run")
-options.add_argument("--disable-sync")
-options.add_argument("--disable-popup-blocking")
-options.add_argument(f"--user-data-dir={user_data_dir}")
-if not show_browser:
-    options.add_argument("--headless")
+driver_path = patched_chromedriver()
+options = bot_chrome_options(cfg.user_data_dir)
+# Return from driver.get() once navigation starts; the name-prompt wait below gates the join
+# instead of Meet's full load event (fonts, images, analytics beacons).
+options.page_load_strategy = "none"
+if cfg.chrome_path:
+    options.binary_location = cfg.chrome_path
+for arg in MEET_CHROME_ARGS:
+    options.add_argument(arg)
+if not cfg.show_browser:
+    # The old headless mode has no screen capture, so getDisplayMedia only works in the new one.
+    options.add_argument("--headless=new")
     options.add_argument("--remote-debugging-port=9222")
-options.add_argument("--use-fake-ui-for-media-stream")
-options.add_argument("--use-fake-device-for-media-stream")
-options.add_argument("--autoplay-policy=no-user-gesture-required")
-options.add_argument(f"--window-size={width},{height}")
+    # Let getDisplayMedia pick the Meet tab without a picker for in-browser recording.
+    options.add_argument("--enable-usermedia-screen-capturing")
+    options.add_argument("--auto-accept-this-tab-capture")
+    options.add_argument("--auto-select-desktop-capture-source=Meet")
+options.add_argument(f"--window-size={cfg.width},{cfg.height}")
 
 try:
     logger.info("Starting undetected Chrome WebDriver...")
-    driver = uc.Chrome(options=options)
+    driver = uc.Chrome(options=options, executable_path=driver_path)
 except WebDriverException as e:
     logger.error(f"Failed to start undetected Chrome WebDriver: {e}")
     if xvfb_proc:
         xvfb_proc.kill()
     raise
 
-logger.info(f"Navigating to Google Meet link: {meet_link}")
-driver.get(meet_link)
-handle_popups(driver, logger=logger, timeout=3)
+install_popup_dismisser(driver)
+logger.info(f"Navigating to Google Meet link: {cfg.meet_link}")
+driver.get(cfg.meet_link)
 
 # --- Handle guest join (enter name) if prompted ---
-try:
-    name_input = WebDriverWait(driver, 10).until(
-        lambda d: d.find_element(By.XPATH, '//input[@aria-label="Your name"]')
-    )
-    logger.info("Google Meet is asking for a name; entering display name...")
-    name_input.clear()
-    name_input.send_keys(display_name)
-    logger.info(f"Entered name: {display_name}")
-except Exception:
+if enter_guest_name(driver, cfg.display_name):
+    logger.info(f"Entered name: {cfg.display_name}")
+else:
     logger.info("No guest name prompt detected; you may already be logged in.")
 
+# --- Fail fast if the recording could never be uploaded ---
+try:
+    signed_url_prefetch.result(timeout=30)
+except Exception as e:
+    logger.error(f"Could not get an upload URL from {UPLOAD_SERVER_URL}; not joining: {e!r}")
+    driver.quit()
+    if xvfb_proc:
+        xvfb_proc.kill()
+    raise
+
 # --- Click join button ---
-join_button_xpath = '//button[.//span[contains(text(), "Join now") or contains(text(), "Ask to join")]]'
 try:
-    WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.XPATH, join_button_xpath)))
-    join_button = driver.find_element(By.XPATH, join_button_xpath)
-    join_text = join_button.text
-    join_button.click()
+    join_text = WebDriverWait(driver, 20, poll_frequency=0.1).until(lambda d: d.execute_script(CLICK_JOIN_SCRIPT))
     logger.info(f"Clicked \"{join_text}\" to join the meeting.")
 except Exception as e:
     logger.error(f"Failed to click the join button: {e}")
@@ -281,7 +518,7 @@ except Exception as e:
     raise
 
 logger.info("Joined meeting (or waiting for host approval). Starting recording...")
-threading.Thread(target=periodic_popup_handler, args=(driver, logger), daemon=True).start()
+threading.Thread(target=log_dismissed_popups, args=(driver, logger), daemon=True).start()
 
 # --- Start Flask server in a background thread ---
 flask_thread = threading.Thread(target=run_flask, daemon=True)
@@ -290,65 +527,127 @@ logger.info("Flask endpoint for internal stop is running on port 5001.")
 
 # --- Start FFmpeg recording (video + audio) ---
 ffmpeg_process = None
-display_used = os.environ.get("DISPLAY", f":{display_num}")
-os.makedirs(os.path.dirname(record_path), exist_ok=True)
-
-
-if "headless" in options.arguments:
-    ffmpeg_cmd = [
-        "ffmpeg", "-y", "-nostats",
-        "-f", "pulse", "-i", "default",
-        "-c:a", "aac", "-b:a", "128k", record_path.replace(".mp4", "_audio.mp4")
-    ]
-    logger.warning("Headless mode active; recording only audio.")
+ffmpeg_cmd = None
+stream_url = None
+capture_path = record_path
+display_used = os.environ.get("DISPLAY", f":{cfg.display_num}")
+
+if not cfg.show_browser:
+    # Headless: record in-browser with MediaRecorder; FFmpeg is only used when a display is grabbed.
+    driver.set_script_timeout(30)
+    try:
+        result = driver.execute_async_script(BROWSER_RECORDER_START_SCRIPT)
+    except WebDriverException as e:
+        result = e
+    if result is True:
+        record_path = os.path.splitext(record_path)[0] + ".webm"
+        open(record_path, "wb").close()
+        browser_recording = True
+        browser_drain_thread = threading.Thread(target=drain_browser_recording, name="browser-recording-drain", daemon=True)
+        browser_drain_thread.start()
+        logger.info(f"Headless mode active; recording in-browser to {record_path}.")
+    else:
+        # Without tab capture there is still the meeting audio on the PulseAudio sink.
+        logger.error(f"Failed to start in-browser recording; recording audio only: {result}")
+        capture_path = record_path = os.path.splitext(record_path)[0] + "_audio.mp4"
+        ffmpeg_cmd = [
+            "ffmpeg", "-y", "-nostats",
+            *PULSE_INPUT_ARGS, "-f", "pulse", "-i", "default",
+            *AUDIO_ENCODER_ARGS,
+            record_path
+        ]
 else:
     if os.path.exists(record_path):
         logger.info("Record output file already exists.")
-        # Check if any running ffmpeg process is using the record file.
-        for proc in psutil.process_iter(attrs=["cmdline"]):
-            cmdline = proc.info.get("cmdline", [])
-            if cmdline and "ffmpeg" in cmdline[0] and record_path in ' '.join(cmdline):
-                logger.info("The record output file is currently being recorded.")
-                break
     else:
-        # Create the file before recording
-        with open(record_path, 'w') as f:
-            pass
         logger.info("Created the record output file.")
+    # Held for the whole recording: another recorder on the same path sees the lock instead of
+    # having to scan every process's cmdline.
+    record_lock = open(record_path, "ab")
+    try:
+        fcntl.flock(record_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info("The record output file is currently being recorded.")
+
+    # Now build the ffmpeg command.
+    if cfg.offline_transcode:
+        capture_path = os.path.splitext(record_path)[0] + ".mkv"
+        vcodec_input_args = []
+        # libx264rgb takes x11grab's RGB frames without a colourspace conversion.
+        vcodec_args = ["-c:v", "libx264rgb", "-preset", "ultrafast", "-qp", "0", "-threads", str(ENCODER_THREADS)]
+        audio_args = ["-c:a", "pcm_s16le"]
+        container_args = []
+    else:
+        vcodec_input_args, vcodec_args = video_encoder_args(pick_video_encoder())
+        audio_args = AUDIO_ENCODER_ARGS
+        # Fragmented MP4: no moov rewrite on stop, and the file stays playable if ffmpeg is killed.
+        container_args = ["-movflags", "+frag_keyframe+empty_moov+default_base_moof", "-frag_duration", "1000000"]
+
+    if cfg.stream_upload and not cfg.offline_transcode:
+        # The live upload takes the prefetched URL, so a fallback upload asks for a new one.
+        stream_url, prefetched_signed_url = prefetched_signed_url, None
+    if stream_url:
+        # Tee the fragments to the local file (the fallback upload) and to stdout for the live upload.
+        # The tee muxer hides MP4's need for global headers from the encoders, so ask for them.
+        fmp4 = "f=mp4:movflags=+frag_keyframe+empty_moov+default_base_moof:frag_duration=1000000"
+        output_args = [
+            "-flags", "+global_header", "-map", "0:v", "-map", "1:a",
+            "-f", "tee", f"[{fmp4}]{capture_path}|[{fmp4}]pipe:1"
+        ]
+    else:
+        output_args = [*container_args, capture_path]
+    ffmpeg_cmd = [
+        "ffmpeg", "-y", "-nostats",
+        *vcodec_input_args,
+        *X11GRAB_INPUT_ARGS,
+        "-f", "x11grab",
+        "-draw_mouse", "0",
+        "-framerate", str(cfg.recording_fps),
+        "-video_size", f"{cfg.width}x{cfg.height}",
+        "-i", f"{display_used}.0",
+        *PULSE_INPUT_ARGS,
+        "-f", "pulse",
+        "-i", "default",
+        *vcodec_args,
+        *audio_args,
+        *output_args
+    ]
 
-# Now build the ffmpeg command.
-ffmpeg_cmd = [
-    "ffmpeg", "-y", "-nostats",
-    "-f", "x11grab",
-    "-video_size", f"{width}x{height}",
-    "-i", f"{display_used}.0",
-    "-f", "pulse",
-    "-i", "default",
-    "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
-    "-c:a", "aac", "-b:a", "128k",
-    "-r", "25", record_path
-]
-
-try:
-    logger.info("Launching FFmpeg for screen and audio recording...")
-    ffmpeg_process = subprocess.Popen(ffmpeg_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    logger.info(f"FFmpeg started with PID {ffmpeg_process.pid}")
-except Exception as e:
-    logger.error(f"Failed to start FFmpeg: {e}")
-    driver.quit()
-    if xvfb_proc:
-        xvfb_proc.kill()
-    raise
+if ffmpeg_cmd:
+    try:
+        logger.info("Launching FFmpeg for screen and audio recording...")
+        ffmpeg_process = subprocess.Popen(
+            ffmpeg_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE if stream_url else subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        log_ffmpeg_stderr(ffmpeg_process, logger)
+        if stream_url:
+            # The upload thread owns stdout, so communicate() only sends the quit command.
+            ffmpeg_stdout, ffmpeg_process.stdout = ffmpeg_process.stdout, None
+            stream_upload_thread = threading.Thread(
+                target=stream_recording_upload, args=(ffmpeg_stdout, stream_url), name="stream-upload"
+            )
+            stream_upload_thread.start()
+        logger.info(f"FFmpeg started with PID {ffmpeg_process.pid}")
+    except Exception as e:
+        logger.error(f"Failed to start FFmpeg: {e}")
+        driver.quit()
+        if xvfb_proc:
+            xvfb_proc.kill()
+        raise
 
 logger.info("Recording in progress. Press Ctrl+C or send a POST request to /internal_stop to stop.")
 
-# --- Main loop now checks for the stop event ---
-try:
-    while not stop_event.is_set():
-        time.sleep(1)
-except KeyboardInterrupt:
-    logger.info("Keyboard interrupt received, stopping recording...")
+# --- Block until stopped: by /internal_stop, Ctrl+C or SIGTERM ---
+def _handle_stop_signal(signum, frame):
+    logger.info(f"Received {signal.Signals(signum).name}, stopping recording...")
     stop_event.set()
+
+signal.signal(signal.SIGINT, _handle_stop_signal)
+signal.signal(signal.SIGTERM, _handle_stop_signal)
+
+try:
+    stop_event.wait()
 finally:
     if ffmpeg_process:
         try:
@@ -357,9 +656,15 @@ finally:
         except Exception as e:
             logging.warning(f"FFmpeg did not stop gracefully: {e}")
             ffmpeg_process.kill()
+        if stream_upload_thread:
+            stream_upload_thread.join()
+    elif browser_recording and not already_stopped:
+        stop_browser_recording()
     if driver:
         driver.quit()
         logger.info("Chrome WebDriver closed.")
     if xvfb_proc:
         xvfb_proc.kill()
         logger.info("Xvfb process terminated.")
+    # No-op if stopScript already transcoded; runs after teardown so Chrome isn't competing for CPU.
+    transcode_recording()
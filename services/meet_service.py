@@ -2,73 +2,50 @@ import os
 import time
 import logging
 import subprocess
-import threading
-import uuid
+import secrets
 import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
 
-from utils.session_store import get_session, update_session, add_session, remove_session
+from utils.session_store import get_session, patch_session, set_status, add_session
 from utils.background_tasks import task_manager
 from utils.display_manager import display_manager
+from utils.process_wait import wait_for_exit
+from utils.pulse_audio import pulseaudio_running
+from utils.chromedriver_cache import patched_chromedriver
+from utils.chrome_profile import MEET_CHROME_ARGS, bot_chrome_options
+from utils.meet_scripts import CLICK_JOIN_SCRIPT, enter_guest_name, install_popup_dismisser
+from utils.video_encoder import (
+    AUDIO_ENCODER_ARGS, PULSE_INPUT_ARGS, X11GRAB_INPUT_ARGS, log_ffmpeg_stderr, pick_video_encoder,
+    video_encoder_args
+)
 from models.meeting import MeetingStatus
 
 logger = logging.getLogger(__name__)
 
-def handle_popups(driver, logger=None, timeout=3):
+def load_session_sink(session_id: str):
     """
-    Looks for common pop-ups or info boxes in Google Meet
-    and dismisses them if present. Adjust XPaths or text as needed.
+    Load a PulseAudio null sink dedicated to the session so concurrent bots on the shared
+    PulseAudio daemon don't mix into each other's recordings. Returns (sink_name, module_id).
     """
-    if logger is None:
-        import logging
-        logger = logging.getLogger(__name__)
+    sink_name = f"bot_{session_id}"
+    result = subprocess.run(
+        ["pactl", "load-module", "module-null-sink", f"sink_name={sink_name}"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Failed to load PulseAudio null sink: {result.stderr.strip()}")
+    logger.info(f"Loaded PulseAudio sink '{sink_name}' for session {session_id}.")
+    return sink_name, result.stdout.strip()
 
-    # Add additional selectors for the new popup
-    popup_selectors = [
-        ('//span[text()="Got it"]', 'Got it'),
-        # This will click the "Allow microphone and camera" button
-        # ('//span[text()="Allow microphone and camera"]', 'Allow microphone and camera'),
-        # Or, if you want to continue without mic/camera:
-        ('//span[text()="Continue without microphone and camera"]', 'Continue without microphone and camera'),
-        ('//span[text()="Continue without microphone"]', 'Continue without microphone'),
-    ]
-
-    for xpath, desc in popup_selectors:
-        try:
-            # Use presence_of_element_located first to check if element exists
-            if WebDriverWait(driver, timeout).until(
-                EC.presence_of_element_located((By.XPATH, xpath))
-            ):
-                # Then find it again to click it (to avoid stale element issues)
-                elem = driver.find_element(By.XPATH, xpath)
-                elem.click()
-                logger.info(f"Dismissed/Clicked '{desc}' popup.")
-                # Brief pause to let the UI update
-                time.sleep(0.5)
-        except (NoSuchElementException, TimeoutException):
-            # If that particular element isn't found quickly, move on
-            pass
-        except Exception as e:
-            logger.warning(f"Could not dismiss '{desc}' popup: {e}")
-
-def periodic_popup_handler(driver, session_id, logger):
-    """Periodically check and handle popups"""
-    while True:
-        session_data = get_session(session_id)
-        if not session_data or session_data.get('status') in [MeetingStatus.STOPPED, MeetingStatus.ERROR]:
-            logger.info(f"Stopping popup handler for session {session_id}")
-            break
-
-        try:
-            handle_popups(driver, logger=logger, timeout=2)
-            time.sleep(5)  # check every 5 seconds
-        except Exception as e:
-            logger.warning(f"Popup handler encountered an error: {e}")
-            break
+def unload_session_sink(module_id: str):
+    """Unload a sink loaded by load_session_sink."""
+    result = subprocess.run(
+        ["pactl", "unload-module", module_id],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    if result.returncode != 0:
+        logger.error(f"Failed to unload PulseAudio module {module_id}: {result.stderr.strip()}")
 
 class MeetService:
     """Service for managing Google Meet recording sessions"""
@@ -86,7 +63,7 @@ class MeetService:
         """Start a new meeting recording session"""
         
         # Generate unique session ID and create directory for this session
-        session_id = str(uuid.uuid4())
+        session_id = secrets.token_hex(16)
         session_dir = os.path.join("recordings", session_id)
         os.makedirs(session_dir, exist_ok=True)
         
@@ -142,9 +119,7 @@ class MeetService:
         
         try:
             # Update session status to joining
-            session_data = get_session(session_id)
-            session_data['status'] = MeetingStatus.JOINING
-            update_session(session_id, session_data)
+            set_status(session_id, MeetingStatus.JOINING)
             
             # Parse screen resolution
             try:
@@ -158,105 +133,88 @@ class MeetService:
             if not display_env:
                 raise RuntimeError("Failed to allocate display for the session")
             
-            session_data['display'] = display_env
-            update_session(session_id, session_data)
-            
-            # Set environment variables for this session
-            os.environ["DISPLAY"] = display_env
+            x_offset, y_offset = display_manager.get_offset(session_id)
+            patch_session(session_id, display=display_env)
             
             # Start PulseAudio if needed
-            try:
-                subprocess.run(["pulseaudio", "--check"], check=True)
+            if pulseaudio_running():
                 logger.info("PulseAudio is already running.")
-            except subprocess.CalledProcessError:
+            else:
                 try:
                     subprocess.run(["pulseaudio", "--start"], check=True)
                     logger.info("PulseAudio daemon started.")
                 except Exception as e:
                     logger.error(f"Failed to start PulseAudio: {e}")
             
+            sink_name, sink_module = load_session_sink(session_id)
+            patch_session(session_id, sink_module=sink_module)
+            
             # Launch Chrome driver
-            options = uc.ChromeOptions()
+            driver_path = patched_chromedriver()
+            options = bot_chrome_options(user_data_dir)
+            # driver.get() returns as soon as navigation starts; the explicit waits below gate every step
+            # instead of Meet's full load event (fonts, images, analytics beacons).
+            options.page_load_strategy = "none"
             if chrome_path:
                 options.binary_location = chrome_path
-
-            options.add_argument("--disable-gpu")
-            options.add_argument("--no-sandbox")
-            options.add_argument("--disable-dev-shm-usage")
-            options.add_argument("--no-first-run")
-            options.add_argument("--disable-sync")
-            options.add_argument("--disable-popup-blocking")
-            if user_data_dir:
-                options.add_argument(f"--user-data-dir={user_data_dir}")
+            for arg in MEET_CHROME_ARGS:
+                options.add_argument(arg)
             if not show_browser:
                 options.add_argument("--headless")
-                options.add_argument("--remote-debugging-port=9222")
-            options.add_argument("--use-fake-ui-for-media-stream")
-            options.add_argument("--use-fake-device-for-media-stream")
-            options.add_argument("--autoplay-policy=no-user-gesture-required")
             options.add_argument(f"--window-size={width},{height}")
+            options.add_argument(f"--window-position={x_offset},{y_offset}")
 
-            driver = uc.Chrome(options=options)
-            session_data['driver'] = driver
-            update_session(session_id, session_data)
+            # Chrome inherits chromedriver's environment, so the session's display and sink go to
+            # chromedriver alone rather than into os.environ, where every later subprocess sees them.
+            service = Service(driver_path, env={**os.environ, "DISPLAY": display_env, "PULSE_SINK": sink_name})
+            driver = uc.Chrome(options=options, executable_path=driver_path, service=service)
+            patch_session(session_id, driver=driver)
             
+            install_popup_dismisser(driver)
             logger.info(f"Navigating to Google Meet link: {meet_link}")
             driver.get(meet_link)
-            handle_popups(driver, logger=logger, timeout=3)
             
             # Handle guest join if prompted
-            try:
-                name_input = WebDriverWait(driver, 10).until(
-                    lambda d: d.find_element(By.XPATH, '//input[@aria-label="Your name"]')
-                )
-                logger.info("Google Meet is asking for a name; entering display name...")
-                name_input.clear()
-                name_input.send_keys(display_name)
+            if enter_guest_name(driver, display_name):
                 logger.info(f"Entered name: {display_name}")
-            except Exception:
+            else:
                 logger.info("No guest name prompt detected; you may already be logged in.")
             
             # Click join button
-            join_button_xpath = '//button[.//span[contains(text(), "Join now") or contains(text(), "Ask to join")]]'
             try:
-                WebDriverWait(driver, 20).until(EC.element_to_be_clickable((By.XPATH, join_button_xpath)))
-                join_button = driver.find_element(By.XPATH, join_button_xpath)
-                join_text = join_button.text
-                join_button.click()
+                join_text = WebDriverWait(driver, 20, poll_frequency=0.1).until(lambda d: d.execute_script(CLICK_JOIN_SCRIPT))
                 logger.info(f"Clicked \"{join_text}\" to join the meeting.")
             except Exception as e:
                 logger.error(f"Failed to click the join button: {e}")
                 raise
             
-            # Start periodic popup handler
-            threading.Thread(
-                target=periodic_popup_handler, 
-                args=(driver, session_id, logger), 
-                daemon=True
-            ).start()
-            
             # Start FFmpeg recording
             display_used = display_env
             if "headless" in options.arguments:
                 # In headless mode, record audio only
                 ffmpeg_cmd = [
                     "ffmpeg", "-y", "-nostats",
-                    "-f", "pulse", "-i", "default",
-                    "-c:a", "aac", "-b:a", "128k",
+                    *PULSE_INPUT_ARGS, "-f", "pulse", "-i", f"{sink_name}.monitor",
+                    *AUDIO_ENCODER_ARGS,
                     record_path.replace(".mp4", "_audio.mp4")
                 ]
                 logger.warning("Headless mode active; recording only audio.")
             else:
+                vcodec_input_args, vcodec_args = video_encoder_args(pick_video_encoder())
                 ffmpeg_cmd = [
                     "ffmpeg", "-y", "-nostats",
+                    *vcodec_input_args,
+                    *X11GRAB_INPUT_ARGS,
                     "-f", "x11grab",
+                    "-draw_mouse", "0",
+                    "-framerate", os.environ.get("RECORDING_FPS", "15"),
                     "-video_size", f"{width}x{height}",
-                    "-i", f"{display_used}.0",
+                    "-i", f"{display_used}.0+{x_offset},{y_offset}",
+                    *PULSE_INPUT_ARGS,
                     "-f", "pulse",
-                    "-i", "default",
-                    "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
-                    "-c:a", "aac", "-b:a", "128k",
-                    "-r", "25",
+                    "-i", f"{sink_name}.monitor",
+                    *vcodec_args,
+                    *AUDIO_ENCODER_ARGS,
                     record_path
                 ]
                 
@@ -264,17 +222,20 @@ class MeetService:
             ffmpeg_process = subprocess.Popen(
                 ffmpeg_cmd, 
                 stdin=subprocess.PIPE, 
-                stdout=subprocess.PIPE, 
+                stdout=subprocess.DEVNULL, 
                 stderr=subprocess.PIPE
             )
+            log_ffmpeg_stderr(ffmpeg_process, logger, f"ffmpeg[{session_id}]")
             logger.info(f"FFmpeg started with PID {ffmpeg_process.pid}")
             
-            session_data['ffmpeg_process'] = ffmpeg_process
-            session_data['status'] = MeetingStatus.RECORDING
-            update_session(session_id, session_data)
+            patch_session(session_id, ffmpeg_process=ffmpeg_process)
+            set_status(session_id, MeetingStatus.RECORDING)
             
-            # Monitor the session status for stop requests
             while True:
+                # Blocks on ffmpeg's pidfd: stop_meeting makes ffmpeg quit, so a stop or a crash both
+                # wake the loop at once. The timeout only catches stops made from another worker
+                # process through a shared store.
+                wait_for_exit(ffmpeg_process, 30)
                 updated_session = get_session(session_id)
                 if not updated_session:
                     logger.warning(f"Session {session_id} not found. Stopping recording.")
@@ -288,17 +249,13 @@ class MeetService:
                 if ffmpeg_process.poll() is not None:
                     logger.warning(f"FFmpeg process terminated unexpectedly with code {ffmpeg_process.poll()}")
                     break
-                
-                time.sleep(5)
             
             return {"status": "completed", "recording_path": record_path}
             
         except Exception as e:
             logger.exception(f"Error in meeting session {session_id}: {str(e)}")
-            session_data = get_session(session_id) or {}
-            session_data['status'] = MeetingStatus.ERROR
-            session_data['error'] = str(e)
-            update_session(session_id, session_data)
+            patch_session(session_id, error=str(e))
+            set_status(session_id, MeetingStatus.ERROR)
             return {"status": "error", "error": str(e)}
         
         finally:
@@ -322,16 +279,19 @@ class MeetService:
                         driver.quit()
                         logger.info(f"Chrome WebDriver closed for session {session_id}.")
                     
-                    # Release the display
+                    # Release the display and the session's audio sink
                     display_manager.release_display(session_id)
+                    if session_data.get('sink_module'):
+                        unload_session_sink(session_data['sink_module'])
                     
-                    if session_data.get('status') != MeetingStatus.ERROR:
-                        session_data['status'] = MeetingStatus.STOPPED
+                    status = session_data.get('status')
+                    if status != MeetingStatus.ERROR:
+                        status = MeetingStatus.STOPPED
                     
-                    session_data['driver'] = None
-                    session_data['ffmpeg_process'] = None
-                    session_data['end_time'] = time.time()
-                    update_session(session_id, session_data)
+                    patch_session(
+                        session_id, sink_module=None, driver=None, ffmpeg_process=None, end_time=time.time()
+                    )
+                    set_status(session_id, status)
                     
                 except Exception as e:
                     logger.exception(f"Error during cleanup for session {session_id}: {str(e)}")
@@ -344,8 +304,15 @@ class MeetService:
             return False
         
         if session_data.get('status') == MeetingStatus.RECORDING:
-            session_data['status'] = MeetingStatus.STOPPED
-            update_session(session_id, session_data)
+            set_status(session_id, MeetingStatus.STOPPED)
+            # Ask ffmpeg to finish; its exit wakes the session thread, which does the cleanup.
+            ffmpeg_process = session_data.get('ffmpeg_process')
+            if ffmpeg_process and ffmpeg_process.poll() is None:
+                try:
+                    ffmpeg_process.stdin.write(b"q")
+                    ffmpeg_process.stdin.flush()
+                except OSError:
+                    pass
             return True
         
         return False
@@ -1,16 +1,20 @@
 # services/zoom_bot.py
-import time
 import os
 import logging
 import base64
-import json
+import re
+import threading
 import undetected_chromedriver as uc  # Import undetected-chromedriver
 from selenium.common.exceptions import WebDriverException, TimeoutException
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 from utils import session_store
+from utils.chromedriver_cache import patched_chromedriver
+from utils.video_encoder import (
+    AUDIO_ENCODER_ARGS, PULSE_INPUT_ARGS, X11GRAB_INPUT_ARGS, log_ffmpeg_stderr, pick_video_encoder,
+    video_encoder_args
+)
+from utils.chrome_profile import bot_chrome_options, ephemeral_profile_dir, remove_profile_dir
 
 # Additional import for headless recording functionality
 from pyvirtualdisplay import Display
@@ -23,6 +27,110 @@ MEDIA_RECORDER_SCRIPT = """
 // MediaRecorder functionality for Zoom meetings
 window.mediaRecorder = null;
 window.recordedChunks = [];
+window.compositorWorker = null;
+window.videoObserver = null;
+
+// Composites participant frames on a worker: each track's VideoFrames are drawn straight into
+// their tile of an OffscreenCanvas, and a composite frame is emitted at most 30 times a second
+// when a tile changed. Nothing is read back from <video> elements or drawn on the page's thread.
+// Tracks can be added while recording; a tile is given back when its track ends.
+const COMPOSITOR_WORKER_SOURCE = `
+let canvas = null;
+let ctx = null;
+const sources = [];
+let tiles = [];
+let dirty = false;
+
+function layoutTiles() {
+    const count = Math.max(sources.length, 1);
+    const cols = Math.ceil(Math.sqrt(count));
+    const rows = Math.ceil(count / cols);
+    const tileWidth = canvas.width / cols;
+    const tileHeight = canvas.height / rows;
+    tiles = sources.map((_, i) => [(i % cols) * tileWidth, Math.floor(i / cols) * tileHeight, tileWidth, tileHeight]);
+    ctx.fillStyle = 'black';
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+    // Redraw everyone's last frame so paused feeds don't turn black after a relayout.
+    sources.forEach((source, i) => {
+        if (source.frame) {
+            ctx.drawImage(source.frame, ...tiles[i]);
+        }
+    });
+    dirty = true;
+}
+
+async function addSource(readable) {
+    const source = { frame: null };
+    sources.push(source);
+    layoutTiles();
+    const reader = readable.getReader();
+    for (;;) {
+        const { value: frame, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        if (source.frame) {
+            source.frame.close();
+        }
+        source.frame = frame;
+        ctx.drawImage(frame, ...tiles[sources.indexOf(source)]);
+        dirty = true;
+    }
+    if (source.frame) {
+        source.frame.close();
+    }
+    sources.splice(sources.indexOf(source), 1);
+    layoutTiles();
+}
+
+self.onmessage = ({ data }) => {
+    if (data.readable) {
+        addSource(data.readable);
+        return;
+    }
+    canvas = new OffscreenCanvas(data.width, data.height);
+    ctx = canvas.getContext('2d');
+    layoutTiles();
+    const writer = data.writable.getWriter();
+    setInterval(() => {
+        // Skip the tick rather than queue frames when the encoder is behind.
+        if (!dirty || writer.desiredSize <= 0) {
+            return;
+        }
+        dirty = false;
+        writer.write(new VideoFrame(canvas, { timestamp: Math.round(performance.now() * 1000) }));
+    }, 1000 / 30);
+};
+`;
+
+// Start the worker compositor and return its output track, or null where the browser (or the
+// page's CSP) doesn't allow it and the canvas fallback must be used.
+function startWorkerCompositor(videos, width, height) {
+    if (!window.MediaStreamTrackProcessor || !window.MediaStreamTrackGenerator) {
+        return null;
+    }
+    if (Array.from(videos).some(video => !video.srcObject || video.srcObject.getVideoTracks().length === 0)) {
+        return null;
+    }
+    try {
+        const generator = new MediaStreamTrackGenerator({ kind: 'video' });
+        const workerUrl = URL.createObjectURL(new Blob([COMPOSITOR_WORKER_SOURCE], { type: 'text/javascript' }));
+        window.compositorWorker = new Worker(workerUrl);
+        window.compositorWorker.postMessage({ writable: generator.writable, width, height }, [generator.writable]);
+        return generator;
+    } catch (error) {
+        console.warn("Worker compositor unavailable, compositing on the page:", error);
+        return null;
+    }
+}
+
+// Collect the <video> elements in a node added to or removed from the page.
+function videosIn(node) {
+    if (node.tagName === 'VIDEO') {
+        return [node];
+    }
+    return node.querySelectorAll ? Array.from(node.querySelectorAll('video')) : [];
+}
 
 window.startMeetingRecording = async function() {
     try {
@@ -30,13 +138,15 @@ window.startMeetingRecording = async function() {
         console.log("Waiting for video elements to initialize...");
         await new Promise(resolve => setTimeout(resolve, 5000));
         
-        const videoElements = document.querySelectorAll('video');
-        if (videoElements.length === 0) {
+        // Kept current by a MutationObserver below, so late joiners are recorded without
+        // re-querying the DOM every frame.
+        const videos = new Set(document.querySelectorAll('video'));
+        if (videos.size === 0) {
             console.error("No video elements found to record");
             return false;
         }
         
-        console.log(`Found ${videoElements.length} video elements`);
+        console.log(`Found ${videos.size} video elements`);
         
         // Create a canvas that combines all video elements
         const canvas = document.createElement('canvas');
@@ -48,36 +158,108 @@ window.startMeetingRecording = async function() {
         const audioContext = new AudioContext();
         const audioDestination = audioContext.createMediaStreamDestination();
         
-        videoElements.forEach(video => {
-            if (video.srcObject) {
-                video.srcObject.getAudioTracks().forEach(track => {
-                    const source = audioContext.createMediaStreamSource(new MediaStream([track]));
-                    source.connect(audioDestination);
-                });
+        // Tile rectangles and the black background for empty grid cells, rebuilt only when the
+        // set of videos changes instead of being recomputed and refilled every frame.
+        const background = document.createElement('canvas');
+        background.width = canvas.width;
+        background.height = canvas.height;
+        let layoutStale = true;
+        let tiles = [];
+        let hasEmptyCells = false;
+        
+        function layoutTiles(videoCount) {
+            // One video fills the canvas; more share a near-square grid.
+            const cols = Math.ceil(Math.sqrt(Math.max(videoCount, 1)));
+            const rows = Math.ceil(Math.max(videoCount, 1) / cols);
+            const width = canvas.width / cols;
+            const height = canvas.height / rows;
+            tiles = Array.from({ length: videoCount }, (_, i) => [
+                (i % cols) * width, Math.floor(i / cols) * height, width, height
+            ]);
+            hasEmptyCells = cols * rows > videoCount;
+            const bctx = background.getContext('2d');
+            bctx.fillStyle = 'black';
+            bctx.fillRect(0, 0, background.width, background.height);
+        }
+        
+        const compositeTrack = startWorkerCompositor(videos, canvas.width, canvas.height);
+        
+        // Composite only after some video has presented a new frame rather than on every display
+        // refresh; without requestVideoFrameCallback every animation frame is drawn as before.
+        const frameCallbacks = 'requestVideoFrameCallback' in HTMLVideoElement.prototype;
+        let dirty = true;
+        
+        // Mix each participant's audio and, with the worker compositor, hand it their video
+        // track. Runs again once a late srcObject has loaded; tracks are only taken once.
+        const attachedTracks = new Set();
+        function attachTracks(video) {
+            if (!video.srcObject) {
+                return;
+            }
+            video.srcObject.getTracks().forEach(track => {
+                if (attachedTracks.has(track)) {
+                    return;
+                }
+                attachedTracks.add(track);
+                if (track.kind === 'audio') {
+                    audioContext.createMediaStreamSource(new MediaStream([track])).connect(audioDestination);
+                } else if (compositeTrack) {
+                    const readable = new MediaStreamTrackProcessor({ track }).readable;
+                    window.compositorWorker.postMessage({ readable }, [readable]);
+                }
+            });
+        }
+        
+        function watchVideo(video) {
+            attachTracks(video);
+            video.addEventListener('loadedmetadata', () => attachTracks(video));
+            if (frameCallbacks && !compositeTrack) {
+                const onFrame = () => {
+                    if (!videos.has(video)) {
+                        return;
+                    }
+                    dirty = true;
+                    video.requestVideoFrameCallback(onFrame);
+                };
+                video.requestVideoFrameCallback(onFrame);
+            }
+        }
+        videos.forEach(watchVideo);
+        
+        window.videoObserver = new MutationObserver(mutations => {
+            for (const mutation of mutations) {
+                mutation.addedNodes.forEach(node => videosIn(node).forEach(video => {
+                    if (!videos.has(video)) {
+                        videos.add(video);
+                        watchVideo(video);
+                        layoutStale = dirty = true;
+                    }
+                }));
+                mutation.removedNodes.forEach(node => videosIn(node).forEach(video => {
+                    if (videos.delete(video)) {
+                        layoutStale = dirty = true;
+                    }
+                }));
             }
         });
+        window.videoObserver.observe(document.body, { childList: true, subtree: true });
         
         // Function to draw videos to canvas
         function drawVideosToCanvas() {
-            ctx.fillStyle = 'black';
-            ctx.fillRect(0, 0, canvas.width, canvas.height);
-            
-            const videoCount = videoElements.length;
-            if (videoCount === 1) {
-                // Just one video, display it full size
-                ctx.drawImage(videoElements[0], 0, 0, canvas.width, canvas.height);
-            } else {
-                // Grid layout for multiple videos
-                const cols = Math.ceil(Math.sqrt(videoCount));
-                const rows = Math.ceil(videoCount / cols);
-                const width = canvas.width / cols;
-                const height = canvas.height / rows;
-                
-                videoElements.forEach((video, i) => {
-                    const x = (i % cols) * width;
-                    const y = Math.floor(i / cols) * height;
-                    ctx.drawImage(video, x, y, width, height);
-                });
+            if (dirty || !frameCallbacks) {
+                dirty = false;
+                if (layoutStale) {
+                    layoutTiles(videos.size);
+                    layoutStale = false;
+                }
+                // Full grids cover every pixel, so only a partial last row needs the background.
+                if (hasEmptyCells) {
+                    ctx.drawImage(background, 0, 0);
+                }
+                let i = 0;
+                for (const video of videos) {
+                    ctx.drawImage(video, ...tiles[i++]);
+                }
             }
             
             if (window.mediaRecorder && window.mediaRecorder.state === 'recording') {
@@ -85,15 +267,18 @@ window.startMeetingRecording = async function() {
             }
         }
         
-        // Create a composite media stream
-        const canvasStream = canvas.captureStream(30);
+        // Create a composite media stream, from the worker when it's running
+        const canvasStream = compositeTrack ? new MediaStream([compositeTrack]) : canvas.captureStream(30);
         audioDestination.stream.getAudioTracks().forEach(track => {
             canvasStream.addTrack(track);
         });
         
-        // Create and start the MediaRecorder
+        // Create and start the MediaRecorder. VP8 encodes far cheaper than VP9 in software at
+        // this bitrate; the output stays WebM so the stop-time stream-copy remux keeps working.
+        const mimeType = ['video/webm;codecs=vp8,opus', 'video/webm;codecs=vp9,opus']
+            .find(type => MediaRecorder.isTypeSupported(type));
         window.recordedChunks = [];
-        window.mediaRecorder = new MediaRecorder(canvasStream, { mimeType: 'video/webm; codecs=vp9,opus' });
+        window.mediaRecorder = new MediaRecorder(canvasStream, { mimeType, videoBitsPerSecond: 1500000 });
         
         window.mediaRecorder.ondataavailable = event => {
             if (event.data.size > 0) {
@@ -103,11 +288,21 @@ window.startMeetingRecording = async function() {
         
         window.mediaRecorder.onstop = () => {
             console.log("Recording stopped, preparing data...");
-            window.recordingComplete = true;
+            if (window.videoObserver) {
+                window.videoObserver.disconnect();
+                window.videoObserver = null;
+            }
+            if (window.compositorWorker) {
+                window.compositorWorker.terminate();
+                window.compositorWorker = null;
+            }
         };
         
-        window.mediaRecorder.start(1000); // Collect data every second
-        requestAnimationFrame(drawVideosToCanvas);
+        // One-second slices: shorter timeslices cost noticeably more CPU in dataavailable churn.
+        window.mediaRecorder.start(1000);
+        if (!compositeTrack) {
+            requestAnimationFrame(drawVideosToCanvas);
+        }
         console.log("Meeting recording started successfully");
         return true;
     } catch (error) {
@@ -123,104 +318,85 @@ window.stopMeetingRecording = function() {
             return;
         }
         
-        window.recordingComplete = false;
-        window.mediaRecorder.stop();
-        
-        // Wait for recording to complete processing
-        const checkCompletion = setInterval(() => {
-            if (window.recordingComplete) {
-                clearInterval(checkCompletion);
-                
-                try {
-                    const blob = new Blob(window.recordedChunks, { type: 'video/webm' });
-                    resolve(blob);
-                } catch (error) {
-                    reject("Error creating recording blob: " + error);
-                }
-            }
-        }, 100);
-        
         // Timeout after 10 seconds
-        setTimeout(() => {
-            if (!window.recordingComplete) {
-                clearInterval(checkCompletion);
-                reject("Timed out waiting for recording to complete");
-            }
+        const timeout = setTimeout(() => {
+            reject("Timed out waiting for recording to complete");
         }, 10000);
+        
+        // 'stop' fires once the final dataavailable has been delivered.
+        window.mediaRecorder.addEventListener('stop', () => {
+            clearTimeout(timeout);
+            try {
+                const blob = new Blob(window.recordedChunks, { type: 'video/webm' });
+                resolve(blob);
+            } catch (error) {
+                reject("Error creating recording blob: " + error);
+            }
+        }, { once: true });
+        window.mediaRecorder.stop();
     });
 };
 
-window.getRecordedData = function() {
-    return new Promise((resolve, reject) => {
-        if (!window.recordedChunks || window.recordedChunks.length === 0) {
-            reject("No recorded data available");
-            return;
-        }
-        
-        try {
-            const blob = new Blob(window.recordedChunks, { type: 'video/webm' });
-            const reader = new FileReader();
-            
-            reader.onload = () => {
-                resolve(reader.result);
-            };
-            
-            reader.onerror = () => {
-                reject("Error reading recorded data");
-            };
-            
-            reader.readAsDataURL(blob);
-        } catch (error) {
-            reject("Error processing recorded data: " + error);
-        }
-    });
+// Hand the chunks recorded since the last call to done() ("" when there are none). Each pull is
+// base64-encoded because WebDriver can only carry strings back; an ArrayBuffer doesn't survive
+// its JSON. Pulls are a few seconds of video each, so no transfer grows with the meeting.
+window.drainRecordedChunks = function(done) {
+    const chunks = window.recordedChunks;
+    window.recordedChunks = [];
+    if (chunks.length === 0) {
+        done("");
+        return;
+    }
+    const reader = new FileReader();
+    reader.onload = () => done(reader.result.slice(reader.result.indexOf(",") + 1));
+    reader.onerror = () => {
+        window.recordedChunks = chunks.concat(window.recordedChunks);
+        done(null);
+    };
+    reader.readAsDataURL(new Blob(chunks));
 };
 """
 
+_DRAIN_CHUNKS_SCRIPT = "window.drainRecordedChunks(arguments[arguments.length - 1]);"
+_STOP_RECORDER_SCRIPT = """
+const done = arguments[arguments.length - 1];
+window.stopMeetingRecording().then(() => done(true), () => done(false));
+"""
+
+ZOOM_RECORDING_PATH = os.environ.get("ZOOM_RECORDING_PATH", "/home/arnav/media-recorder/meeting_recording.webm")
+
+# Record with ffmpeg off a second, Xvfb-hosted browser instead of the in-page MediaRecorder.
+USE_X11GRAB_RECORDING = os.environ.get("ZOOM_X11GRAB_RECORDING") == "1"
+
+# Seconds between pulls of recorded chunks out of the page.
+CHUNK_DRAIN_INTERVAL = float(os.environ.get("ZOOM_CHUNK_DRAIN_INTERVAL", "5"))
+
+# Meeting id runs from '/j/' to the query string; the password is the 'pwd' parameter.
+_ZOOM_URL_RE = re.compile(r"/j/([^?]*).*?[?&]pwd=([^&]*)")
+
 def convert_zoom_url(url):
-    # Extract meeting id by finding '/j/' and taking the substring until the next '?'
-    try:
-        j_index = url.index("/j/")
-        start = j_index + len("/j/")
-        q_index = url.find("?", start)
-        if q_index == -1:
-            meeting_id = url[start:]
-        else:
-            meeting_id = url[start:q_index]
-    except ValueError:
-        raise ValueError("URL does not contain '/j/' in the expected format.")
-
-    # Extract the password by locating "pwd=" and taking the substring until the next '&' if present.
-    pwd_marker = "pwd="
-    pwd_index = url.find(pwd_marker)
-    if pwd_index == -1:
+    """Turn a zoom.us/j/<id>?pwd=<pwd> invite link into the web client join URL."""
+    match = _ZOOM_URL_RE.search(url)
+    if not match:
+        if "/j/" not in url:
+            raise ValueError("URL does not contain '/j/' in the expected format.")
         raise ValueError("URL does not contain a 'pwd=' parameter.")
-    pwd_start = pwd_index + len(pwd_marker)
-    amp_index = url.find("&", pwd_start)
-    if amp_index == -1:
-        pwd = url[pwd_start:]
-    else:
-        pwd = url[pwd_start:amp_index]
-
-    # Construct the new URL using string concatenation.
-    new_url = "https://app.zoom.us/wc/" + meeting_id + "/join?fromPWA=1&pwd=" + pwd
-    return new_url
+    meeting_id, pwd = match.groups()
+    return f"https://app.zoom.us/wc/{meeting_id}/join?fromPWA=1&pwd={pwd}"
 
 def get_chrome_driver(user_data_dir: str):
     """
     Creates and returns a Chrome WebDriver instance using undetected-chromedriver.
     The '--user-data-dir' argument ensures a separate browser profile per session.
     """
-    options = uc.ChromeOptions()
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
+    driver_path = patched_chromedriver()
+    options = bot_chrome_options(user_data_dir)
     # If you plan to capture media, consider removing the headless mode.
     # options.add_argument("--headless")
-    options.add_argument(f"--user-data-dir={user_data_dir}")
     options.binary_location = "/usr/bin/google-chrome"  # Adjust path if needed
 
     try:
-        driver = uc.Chrome(options=options)
+        driver = uc.Chrome(options=options, executable_path=driver_path)
         logger.info("Undetected Chrome driver started successfully for Zoom.")
         # Increase script timeout for async operations (e.g. stopping recording)
         driver.set_script_timeout(60)
@@ -229,23 +405,119 @@ def get_chrome_driver(user_data_dir: str):
         logger.exception(f"Failed to start undetected Chrome driver for Zoom: {str(e)}")
         raise
 
-def find_element_in_frames(driver, by, value, timeout=20):
+# Depth-first search of the page and its same-origin frames for the first element matching a CSS
+# selector (and exact text, when given). Returns the window.frames index path of the frame that
+# holds it, or null; cross-origin frames aren't readable from the page and are skipped.
+_FIND_IN_FRAMES_SCRIPT = """
+const [selector, text] = arguments;
+const matches = doc => Array.from(doc.querySelectorAll(selector))
+    .some(el => text === null || el.textContent.trim() === text);
+function search(win) {
+    if (matches(win.document)) {
+        return [];
+    }
+    for (let i = 0; i < win.frames.length; i++) {
+        try {
+            const path = search(win.frames[i]);
+            if (path) {
+                return [i, ...path];
+            }
+        } catch (e) {
+            // Cross-origin frame.
+        }
+    }
+    return null;
+}
+return search(window);
+"""
+
+_QUERY_ELEMENT_SCRIPT = """
+const [selector, text] = arguments;
+return Array.from(document.querySelectorAll(selector))
+    .find(el => text === null || el.textContent.trim() === text) || null;
+"""
+
+def _element_in_any_frame(selector, text=None):
     """
-    Attempts to locate an element using the given locator.
-    First tries the default content; if not found, iterates over iframes.
+    WebDriverWait condition that searches the page and all its frames in one script per poll.
+    On a match the driver is left switched into the frame holding the element.
     """
-    try:
-        return WebDriverWait(driver, timeout).until(EC.presence_of_element_located((by, value)))
-    except Exception:
-        iframes = driver.find_elements(By.TAG_NAME, "iframe")
-        for iframe in iframes:
+    def _condition(driver):
+        driver.switch_to.default_content()
+        path = driver.execute_script(_FIND_IN_FRAMES_SCRIPT, selector, text)
+        if path is None:
+            return False
+        try:
+            for index in path:
+                driver.switch_to.frame(index)
+        except WebDriverException:
+            return False  # The frame went away between the search and the switch.
+        return driver.execute_script(_QUERY_ELEMENT_SCRIPT, selector, text) or False
+    return _condition
+
+def find_element_in_frames(driver, selector, text=None, timeout=20):
+    """
+    Locate the first element matching a CSS selector (and exact text, if given) in the page or
+    any of its frames. Raises TimeoutException if none shows up within timeout.
+    """
+    return WebDriverWait(driver, timeout, poll_frequency=0.1).until(_element_in_any_frame(selector, text))
+
+class BrowserRecordingWriter:
+    """
+    Appends the in-page MediaRecorder's WebM chunks to disk while the meeting runs, so the
+    browser's encode is the only one and the recording never piles up in page memory.
+    On stop the file is remuxed with stream copy to give it a seekable index.
+    """
+    def __init__(self, driver, output_file):
+        self.driver = driver
+        self.output_file = output_file
+        self.raw_file = f"{output_file}.part"
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.output_file) or ".", exist_ok=True)
+        open(self.raw_file, "wb").close()
+        self.thread = threading.Thread(target=self._run, name="zoom-recording-writer", daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        data = self.driver.execute_async_script(_DRAIN_CHUNKS_SCRIPT)
+        if data is None:
+            raise WebDriverException("The page could not read its recorded chunks")
+        if data:
+            with open(self.raw_file, "ab") as f:
+                f.write(base64.b64decode(data))
+
+    def _run(self):
+        while not self.stop_event.wait(CHUNK_DRAIN_INTERVAL):
             try:
-                driver.switch_to.frame(iframe)
-                element = WebDriverWait(driver, 5).until(EC.presence_of_element_located((by, value)))
-                return element
-            except Exception:
-                driver.switch_to.default_content()
-        raise Exception(f"Element with locator ({by}, {value}) not found in any frame.")
+                self._drain()
+            except WebDriverException as e:
+                logger.warning(f"Could not pull recorded chunks from the page: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        try:
+            # stopMeetingRecording resolves after the final dataavailable, so one more drain gets it all.
+            self.driver.execute_async_script(_STOP_RECORDER_SCRIPT)
+            self._drain()
+        except WebDriverException as e:
+            logger.error(f"Could not collect the last recorded chunks: {e}")
+
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", self.raw_file, "-c", "copy", self.output_file],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        if result.returncode == 0:
+            os.remove(self.raw_file)
+        else:
+            # The appended chunks already form a playable WebM; keep it even without an index.
+            logger.warning(f"Remux failed, keeping the raw recording: {result.stderr.decode(errors='replace').strip()}")
+            os.replace(self.raw_file, self.output_file)
+        logger.info(f"Recording saved to {self.output_file}")
 
 def join_meeting(meeting_url: str, session_id: str):
     """
@@ -258,60 +530,64 @@ def join_meeting(meeting_url: str, session_id: str):
     
     logger.info(f"Starting Zoom session for {meeting_url} with session_id: {session_id}")
     try:
-        user_data_dir = f"/tmp/chrome_user_data_{session_id}"
-        os.makedirs(user_data_dir, exist_ok=True)
+        user_data_dir = ephemeral_profile_dir(f"chrome_user_data_{session_id}_")
         
         driver = get_chrome_driver(user_data_dir)
         session = session_store.get_session(session_id)
         if session is not None:
             session["driver"] = driver
+            session["profile_dir"] = user_data_dir
         
         driver.get(meeting_url)
         logger.info(f"Navigated to Zoom URL: {meeting_url}")
-        time.sleep(5)
         
         try:
-            name_input = find_element_in_frames(driver, By.ID, "input-for-name", timeout=20)
+            name_input = find_element_in_frames(driver, "#input-for-name", timeout=20)
             name_input.clear()
             name_input.send_keys("Oracia")
             
-            join_button = find_element_in_frames(driver, By.XPATH, "//button[text()='Join']", timeout=20)
+            join_button = find_element_in_frames(driver, "button", text="Join", timeout=20)
             join_button.click()
             logger.info("Successfully filled in name 'Oracia' and clicked 'Join'.")
         except Exception as e:
             logger.exception(f"Could not fill in name or click 'Join': {e}")
         
-        start_headless_recording(meeting_url, session_id, "/home/arnav/media-recorder/meeting_recording.webm")
-        driver.execute_script("window.startMeetingRecording();")
-        logger.info("Started recording the meeting via MediaRecorder API.")
+        if USE_X11GRAB_RECORDING:
+            start_headless_recording(meeting_url, session_id, ZOOM_RECORDING_PATH)
+        else:
+            driver.execute_script(MEDIA_RECORDER_SCRIPT)
+            driver.execute_script("window.startMeetingRecording();")
+            writer = BrowserRecordingWriter(driver, ZOOM_RECORDING_PATH)
+            writer.start()
+            if session is not None:
+                session["browser_recorder"] = writer
+            logger.info("Started recording the meeting via MediaRecorder API.")
         
         if session is not None:
-            session["status"] = "joined"
+            session_store.set_status(session_id, "joined")
             logger.info(f"Session {session_id} successfully joined Zoom meeting and started recording.")
     
     except WebDriverException as e:
         logger.exception(f"WebDriverException in Zoom session {session_id}: {str(e)}")
-        session = session_store.get_session(session_id)
-        if session is not None:
-            session["status"] = f"error: {str(e)}"
+        session_store.set_status(session_id, f"error: {str(e)}")
     except Exception as e:
         logger.exception(f"Unexpected error in Zoom session {session_id}: {str(e)}")
-        session = session_store.get_session(session_id)
-        if session is not None:
-            session["status"] = f"error: {str(e)}"
+        session_store.set_status(session_id, f"error: {str(e)}")
 
 def stop_recording_and_save(session_id: str, output_file: str):
     """
-    Stops the recording by calling the injected JavaScript function.
-    Retrieves the recorded data (a base64 data URL), decodes it,
-    and saves it to the specified output file.
+    Stops the recording: the in-page MediaRecorder's writer flushes and remuxes its file,
+    or, in x11grab mode, the headless ffmpeg session is stopped.
     If no recording is in progress, a warning is logged and the function exits gracefully.
     """
     session = session_store.get_session(session_id)
-  
+    writer = session.pop("browser_recorder", None) if session else None
 
     try:
-        stop_headless_recording(session_id)
+        if writer:
+            writer.stop()
+        else:
+            stop_headless_recording(session_id)
         logger.info(f"Recording Stopped for session {session_id}.")
     except TimeoutException as te:
         logger.error(f"Script timeout during recording stop: {te}")
@@ -327,19 +603,22 @@ def leave_meeting(session_id: str):
     logger.info(f"Attempting to leave Zoom session: {session_id}")
     session = session_store.get_session(session_id)
     
-    output_filepath = "/home/arnav/media-recorder/meeting_recording.webm"
     try:
-        stop_recording_and_save(session_id, output_filepath)
+        stop_recording_and_save(session_id, ZOOM_RECORDING_PATH)
     except Exception as e:
         logger.error(f"Error during recording stop/save: {e}")
     
-    # Uncomment below to close the browser session if needed.
-    # if session and session.get("driver"):
-    #     try:
-    #         session["driver"].quit()
-    #         logger.info(f"Session {session_id} closed successfully.")
-    #     except Exception as e:
-    #         logger.exception(f"Error closing Zoom session {session_id}: {str(e)}")
+    # The profile lives on tmpfs, so the browser has to go for its memory to be reclaimed.
+    if session and session.get("driver"):
+        try:
+            session["driver"].quit()
+            logger.info(f"Session {session_id} closed successfully.")
+        except Exception as e:
+            logger.exception(f"Error closing Zoom session {session_id}: {str(e)}")
+        session["driver"] = None
+        remove_profile_dir(session.pop("profile_dir", None))
+
+    session_store.set_status(session_id, "left")
 
 
 # ===================== BEGIN HEADLESS RECORDING CODE =====================
@@ -410,23 +689,29 @@ class FFMpegRecorder:
 
     def start(self):
         display = os.environ.get("DISPLAY", ":0")
+        vcodec_input_args, vcodec_args = video_encoder_args(pick_video_encoder())
         command = [
             "ffmpeg",
             "-y",  # Overwrite output file if exists
+            "-nostats",
+            *vcodec_input_args,
             "-video_size", f"{self.resolution[0]}x{self.resolution[1]}",
             "-framerate", str(self.fps),
+            *X11GRAB_INPUT_ARGS,
             "-f", "x11grab",
+            "-draw_mouse", "0",
             "-i", display,
+            *PULSE_INPUT_ARGS,
             "-f", "pulse",
             "-i", self.audio_source,
-            "-c:v", "libx264",
-            "-preset", "ultrafast",
-            "-c:a", "aac",
+            *vcodec_args,
+            *AUDIO_ENCODER_ARGS,
             "-copyts",  # Copy timestamps for A/V sync
             self.output_file
         ]
         logger.info("Starting ffmpeg with command: " + " ".join(command))
-        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        log_ffmpeg_stderr(self.process, logger)
         logger.info("ffmpeg recording started.")
 
     def stop(self):
@@ -434,9 +719,8 @@ class FFMpegRecorder:
             logger.info("Stopping ffmpeg recording...")
             self.process.terminate()
             try:
-                stdout, stderr = self.process.communicate(timeout=10)
-                logger.info("ffmpeg terminated. Output:\n" +
-                            stdout.decode('utf-8') + "\n" + stderr.decode('utf-8'))
+                self.process.wait(timeout=10)
+                logger.info("ffmpeg terminated.")
             except subprocess.TimeoutExpired:
                 logger.error("ffmpeg did not terminate in time; killing process.")
                 self.process.kill()
@@ -462,6 +746,7 @@ class HeadlessMeetingRecordingSession:
         self.recorder = FFMpegRecorder(output_file, resolution=resolution, fps=fps,
                                        audio_source=f"{sink_name}.monitor")
         self.driver = None
+        self.user_data_dir = None
 
     def start(self):
         logger.info("Starting headless meeting recording session.")
@@ -469,24 +754,21 @@ class HeadlessMeetingRecordingSession:
         self.audio_manager.start()
 
         # Launch the browser session inside the virtual display.
-        user_data_dir = f"/tmp/chrome_user_data_{self.session_id}_headless"
-        os.makedirs(user_data_dir, exist_ok=True)
-        options = uc.ChromeOptions()
-        options.add_argument("--no-sandbox")
-        options.add_argument("--disable-dev-shm-usage")
-        options.add_argument(f"--user-data-dir={user_data_dir}")
+        self.user_data_dir = ephemeral_profile_dir(f"chrome_user_data_{self.session_id}_headless_")
+        user_data_dir = self.user_data_dir
+        driver_path = patched_chromedriver()
+        options = bot_chrome_options(user_data_dir)
         # Do not use headless mode to ensure media capture.
         options.binary_location = "/usr/bin/google-chrome"  # Adjust if needed
 
         try:
-            self.driver = uc.Chrome(options=options)
+            self.driver = uc.Chrome(options=options, executable_path=driver_path)
         except Exception as e:
             logger.exception("Failed to start Chrome driver in headless session: " + str(e))
             raise
 
         logger.info("Browser session (headless) started; navigating to meeting URL.")
         self.driver.get(self.meeting_url)
-        time.sleep(5)  # Allow page to load
 
         # Start recording using ffmpeg.
         self.recorder.start()
@@ -500,6 +782,7 @@ class HeadlessMeetingRecordingSession:
                 logger.info("Browser session (headless) closed.")
             except Exception as e:
                 logger.error("Error closing headless browser session: " + str(e))
+        remove_profile_dir(self.user_data_dir)
         self.audio_manager.stop()
         self.display_manager.stop()
         logger.info("Headless meeting recording session stopped.")
@@ -0,0 +1,87 @@
+# utils/chrome_profile.py
+# Throwaway Chrome profiles on tmpfs and launch flags shared by the bots.
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+import undetected_chromedriver as uc
+
+# Profiles live in RAM so Chrome's LevelDB/cookie writes never wait on disk fsyncs. They get a
+# dedicated tmpfs (mounted by docker-compose.yml) rather than /dev/shm: a container's /dev/shm
+# is 64MB by default, which is why every bot passes --disable-dev-shm-usage, and a pool's worth
+# of profiles would fill it.
+DEFAULT_PROFILE_ROOT = "/run/chrome-profiles"
+PROFILE_ROOT = os.environ.get(
+    "CHROME_PROFILE_ROOT",
+    DEFAULT_PROFILE_ROOT if os.path.isdir(DEFAULT_PROFILE_ROOT) else tempfile.gettempdir()
+)
+
+# Skip on-disk caches and background work a recording bot never needs.
+LEAN_CHROME_ARGS = [
+    "--disk-cache-dir=/dev/null",
+    "--disable-gpu-shader-disk-cache",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-extensions",
+    "--disable-translate",
+    # Meet is a JS app; skip work that doesn't show up in the recording.
+    "--disable-features=Translate,AutofillServerCommunication,BackForwardCache,"
+    "CalculateNativeWinOcclusion,MediaRouter,OptimizationHints,site-per-process",
+    "--renderer-process-limit=1",
+    # Bot windows are often covered by others on a shared display; keep their renderer and
+    # timers at full rate so the recorded tab doesn't stutter.
+    "--disable-renderer-backgrounding",
+    "--disable-backgrounding-occluded-windows",
+]
+
+# Blocking images saves decode and compositing work but blanks avatars and shared slides in
+# the recording, so it is opt-in: set CHROME_DISABLE_IMAGES=true to enable it.
+DISABLE_IMAGES = os.environ.get("CHROME_DISABLE_IMAGES", "false").lower() == "true"
+
+# Needed by every bot Chrome to run as root in a container without a GPU.
+CONTAINER_CHROME_ARGS = ("--no-sandbox", "--disable-dev-shm-usage", "--disable-gpu")
+
+# Static flags for every Meet bot Chrome: no first-run UI or sync, and fake media devices so
+# Meet never prompts for a camera or microphone.
+MEET_CHROME_ARGS = (
+    "--no-first-run",
+    "--disable-sync",
+    "--disable-popup-blocking",
+    "--use-fake-ui-for-media-stream",
+    "--use-fake-device-for-media-stream",
+    "--autoplay-policy=no-user-gesture-required",
+)
+
+def bot_chrome_options(user_data_dir: Optional[str] = None) -> uc.ChromeOptions:
+    """
+    Return ChromeOptions with CONTAINER_CHROME_ARGS, the profile dir and the lean options, so
+    callers only add their session-specific flags. Call patched_chromedriver() first.
+    """
+    options = uc.ChromeOptions()
+    for arg in CONTAINER_CHROME_ARGS:
+        options.add_argument(arg)
+    if user_data_dir:
+        options.add_argument(f"--user-data-dir={user_data_dir}")
+    apply_lean_options(options)
+    return options
+
+def apply_lean_options(options):
+    """Add LEAN_CHROME_ARGS and the matching content-setting prefs to ChromeOptions."""
+    for arg in LEAN_CHROME_ARGS:
+        options.add_argument(arg)
+    if DISABLE_IMAGES:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option("prefs", {
+            "profile.managed_default_content_settings.images": 2,
+            "profile.managed_default_content_settings.plugins": 2,
+        })
+
+def ephemeral_profile_dir(prefix: str = "chrome_user_data_") -> str:
+    """Create a fresh Chrome user-data-dir under PROFILE_ROOT."""
+    return tempfile.mkdtemp(prefix=prefix, dir=PROFILE_ROOT)
+
+def remove_profile_dir(path: Optional[str]):
+    """Delete a profile created by ephemeral_profile_dir; call only once its Chrome has exited."""
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
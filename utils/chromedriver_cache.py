@@ -0,0 +1,101 @@
+# utils/chromedriver_cache.py
+# Keeps a single patched chromedriver on disk so undetected_chromedriver never re-fetches it.
+import functools
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import zipfile
+from urllib.request import urlretrieve
+
+import undetected_chromedriver as uc
+
+logger = logging.getLogger(__name__)
+
+# Defaults to the user's cache dir so the bots don't need root; UC_DRIVER_CACHE overrides it.
+CHROMEDRIVER_CACHE_DIR = os.environ.get(
+    "UC_DRIVER_CACHE",
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "ucdriver")
+)
+
+def _binary_major_version(binary: str) -> int:
+    """Return the major version a Chrome or chromedriver binary reports, or 0 if unknown."""
+    try:
+        result = subprocess.run(
+            [binary, "--version"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return 0
+    match = re.search(r"(\d+)\.", result.stdout)
+    return int(match.group(1)) if match else 0
+
+def _chrome_major_version() -> int:
+    """Return the installed Chrome's major version (CHROME_MAJOR overrides), or 0 if unknown."""
+    override = os.environ.get("CHROME_MAJOR")
+    if override:
+        return int(override)
+    return _binary_major_version(os.environ.get("CHROME_BINARY", "/usr/bin/google-chrome"))
+
+def _fetch_patched_chromedriver(major: int, workdir: str) -> str:
+    """
+    Download and patch chromedriver inside workdir and return its path.
+    ChromeDriverManager.fetch_chromedriver() is not used: it returns any ./chromedriver in the
+    working directory without checking its version, and extracts into the working directory.
+    """
+    manager = uc.ChromeDriverManager(target_version=major or None)
+    version = manager.get_release_version_number().vstring
+    archive = os.path.join(workdir, "chromedriver.zip")
+    urlretrieve(f"{manager.DL_BASE}{version}/chromedriver_{manager.platform}.zip", filename=archive)
+    with zipfile.ZipFile(archive) as zf:
+        manager.executable_path = zf.extract(manager._exe_name, workdir)
+    if sys.platform != "win32":
+        os.chmod(manager.executable_path, 0o755)
+    manager.patch_binary()
+    return manager.executable_path
+
+def _cached_chromedriver(major: int) -> str:
+    """Return the patched chromedriver in CHROMEDRIVER_CACHE_DIR, fetching it if missing or stale."""
+    path = os.path.join(CHROMEDRIVER_CACHE_DIR, f"chromedriver_{major}" if major else "chromedriver")
+
+    if os.path.exists(path) and major and _binary_major_version(path) != major:
+        logger.warning(f"Cached chromedriver at {path} does not match Chrome {major}; fetching it again.")
+        os.remove(path)
+
+    if not os.path.exists(path):
+        os.makedirs(CHROMEDRIVER_CACHE_DIR, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=CHROMEDRIVER_CACHE_DIR) as workdir:
+            fetched = _fetch_patched_chromedriver(major, workdir)
+            fetched_major = _binary_major_version(fetched)
+            if major and fetched_major != major:
+                raise RuntimeError(f"Downloaded chromedriver {fetched_major} does not match Chrome {major}")
+            # The temp dir sits next to the target, so the rename is atomic for concurrent processes.
+            os.replace(fetched, path)
+        logger.info(f"Cached patched chromedriver at {path}")
+    return path
+
+@functools.lru_cache(maxsize=1)
+def patched_chromedriver() -> str:
+    """
+    Return the path of the cached patched chromedriver, downloading and patching it on first use.
+    Must be called before uc.ChromeOptions()/uc.Chrome(): pinning the target version and marking
+    the driver installed stops undetected_chromedriver from looking up the latest release on
+    every browser launch.
+    """
+    major = _chrome_major_version()
+    if major:
+        uc.TARGET_VERSION = major
+    try:
+        path = _cached_chromedriver(major)
+    except Exception as e:
+        # Fall back once to undetected_chromedriver's own ./chromedriver: lru_cache keeps the
+        # result, whereas an exception here would be retried on every browser launch.
+        logger.error(f"Could not cache chromedriver in {CHROMEDRIVER_CACHE_DIR}; using undetected_chromedriver's download: {e}")
+        manager = uc.ChromeDriverManager(target_version=major or None)
+        manager.install(patch_selenium=False)
+        path = os.path.abspath(manager.executable_path)
+
+    uc.ChromeDriverManager.installed = True
+    return path
@@ -3,17 +3,76 @@ import time
 import logging
 import subprocess
 import threading
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
 
+def _parse_size(size: str) -> Tuple[int, int]:
+    width, height = size.lower().split("x")[:2]
+    return int(width), int(height)
+
 class DisplayManager:
-    """Manages Xvfb display instances for concurrent browser sessions"""
+    """
+    Manages Xvfb displays for concurrent browser sessions.
+    Sessions share one large Xvfb screen and each gets its own tile of it, so N bots cost one
+    X server instead of N. A session larger than a tile, or arriving when every tile is taken,
+    falls back to a dedicated Xvfb.
+    """
     
-    def __init__(self):
-        self.displays = {}  # session_id -> (display_num, process)
+    def __init__(self, shared_size: str = "5120x2160", tile_size: str = "1280x720", depth: int = 24):
+        self.displays = {}  # session_id -> (display_num, dedicated process or None, x, y)
         self.displays_lock = threading.Lock()
         self.next_display = 100  # Start from display :100
+        self.depth = depth
+        self.shared_width, self.shared_height = _parse_size(shared_size)
+        self.tile_width, self.tile_height = _parse_size(tile_size)
+        self.shared_display = None  # (display_num, process) once the shared screen is running
+        self.free_tiles: List[Tuple[int, int]] = [
+            (x, y)
+            for y in range(0, self.shared_height - self.tile_height + 1, self.tile_height)
+            for x in range(0, self.shared_width - self.tile_width + 1, self.tile_width)
+        ]
+    
+    def _start_xvfb(self, width: int, height: int, depth: int) -> Optional[Tuple[int, subprocess.Popen]]:
+        """Start Xvfb on the next free display number. Caller must hold displays_lock."""
+        display_num = self.next_display
+        self.next_display += 1
+        
+        display_env = f":{display_num}"
+        xvfb_cmd = ["Xvfb", display_env, "-screen", "0", 
+                    f"{width}x{height}x{depth}", "-ac"]
+        
+        try:
+            logger.info(f"Starting Xvfb on display {display_env} at {width}x{height}x{depth}")
+            xvfb_proc = subprocess.Popen(
+                xvfb_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            
+            # Wait a moment for Xvfb to initialize
+            time.sleep(1)
+            
+            if xvfb_proc.poll() is not None:
+                error_output = xvfb_proc.stderr.read().decode()
+                logger.error(f"Xvfb failed to start: {error_output.strip()}")
+                return None
+            
+            return display_num, xvfb_proc
+            
+        except Exception as e:
+            logger.error(f"Error starting Xvfb: {str(e)}")
+            return None
+    
+    def _shared_display_num(self) -> Optional[int]:
+        """Return the shared display, starting it on first use. Caller must hold displays_lock."""
+        if self.shared_display and self.shared_display[1].poll() is None:
+            return self.shared_display[0]
+        self.shared_display = self._start_xvfb(self.shared_width, self.shared_height, self.depth)
+        return self.shared_display[0] if self.shared_display else None
+    
+    def prestart(self) -> bool:
+        """Start the shared display now so the first session doesn't pay Xvfb's startup."""
+        with self.displays_lock:
+            return self._shared_display_num() is not None
     
     def allocate_display(self, session_id: str, width: int = 1280, height: int = 720, 
                          depth: int = 24) -> Optional[str]:
@@ -21,55 +80,54 @@ class DisplayManager:
         with self.displays_lock:
             # Check if this session already has a display
             if session_id in self.displays:
-                display_num, _ = self.displays[session_id]
+                display_num = self.displays[session_id][0]
                 return f":{display_num}"
             
-            # Find next available display
-            display_num = self.next_display
-            self.next_display += 1
-            
-            display_env = f":{display_num}"
-            xvfb_cmd = ["Xvfb", display_env, "-screen", "0", 
-                        f"{width}x{height}x{depth}", "-ac"]
+            if width <= self.tile_width and height <= self.tile_height and self.free_tiles:
+                display_num = self._shared_display_num()
+                if display_num is not None:
+                    x, y = self.free_tiles.pop(0)
+                    self.displays[session_id] = (display_num, None, x, y)
+                    logger.info(f"Session {session_id} uses display :{display_num} at offset {x},{y}")
+                    return f":{display_num}"
             
-            try:
-                logger.info(f"Starting Xvfb on display {display_env} for session {session_id}")
-                xvfb_proc = subprocess.Popen(
-                    xvfb_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-                
-                # Wait a moment for Xvfb to initialize
-                time.sleep(1)
-                
-                if xvfb_proc.poll() is not None:
-                    error_output = xvfb_proc.stderr.read().decode()
-                    logger.error(f"Xvfb failed to start: {error_output.strip()}")
-                    return None
-                
-                self.displays[session_id] = (display_num, xvfb_proc)
-                return display_env
-                
-            except Exception as e:
-                logger.error(f"Error starting Xvfb: {str(e)}")
+            started = self._start_xvfb(width, height, depth)
+            if not started:
                 return None
+            display_num, xvfb_proc = started
+            self.displays[session_id] = (display_num, xvfb_proc, 0, 0)
+            return f":{display_num}"
     
     def get_display(self, session_id: str) -> Optional[str]:
         """Get the display number for an existing session"""
         with self.displays_lock:
             if session_id in self.displays:
-                display_num, _ = self.displays[session_id]
+                display_num = self.displays[session_id][0]
                 return f":{display_num}"
             return None
     
+    def get_offset(self, session_id: str) -> Tuple[int, int]:
+        """Get the top-left corner of the session's area on its display"""
+        with self.displays_lock:
+            if session_id in self.displays:
+                _, _, x, y = self.displays[session_id]
+                return x, y
+            return 0, 0
+    
     def release_display(self, session_id: str) -> bool:
         """Release the display for a session"""
         with self.displays_lock:
             if session_id not in self.displays:
                 return False
             
-            display_num, xvfb_proc = self.displays.pop(session_id)
+            display_num, xvfb_proc, x, y = self.displays.pop(session_id)
+            if xvfb_proc is None:
+                # Shared display: just hand the tile back.
+                self.free_tiles.append((x, y))
+                logger.info(f"Released tile {x},{y} of display :{display_num} for session {session_id}")
+                return True
             try:
-                if xvfb_proc and xvfb_proc.poll() is None:
+                if xvfb_proc.poll() is None:
                     xvfb_proc.terminate()
                     xvfb_proc.wait(timeout=5)
                     if xvfb_proc.poll() is None:
@@ -81,4 +139,7 @@ class DisplayManager:
                 return False
 
 # Global instance for use throughout the application
-display_manager = DisplayManager()
+display_manager = DisplayManager(
+    shared_size=os.environ.get("SHARED_DISPLAY_SIZE", "5120x2160"),
+    tile_size=os.environ.get("DISPLAY_TILE_SIZE", "1280x720"),
+)
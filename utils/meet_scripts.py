@@ -0,0 +1,86 @@
+# utils/meet_scripts.py
+# In-page scripts for the Google Meet join flow, shared by MeetService and the standalone recorder.
+import json
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+
+# Popup buttons dismissed by their label text.
+POPUP_LABELS = [
+    'Got it',
+    # 'Allow microphone and camera',
+    # Or, if you want to continue without mic/camera:
+    'Continue without microphone and camera',
+    'Continue without microphone',
+]
+# Installed on every document in the tab: a single MutationObserver clicks any popup button as
+# soon as it is inserted, so popups never cost a WebDriver round trip. Clicked labels are
+# queued in window.__dismissedPopups for callers that want to log them.
+POPUP_DISMISS_SCRIPT = """
+(() => {
+    if (window.__popupObserver) return;
+    const labels = %s;
+    window.__dismissedPopups = [];
+    let scheduled = false;
+    const dismiss = () => {
+        scheduled = false;
+        for (const span of document.querySelectorAll('span')) {
+            if (labels.includes(span.textContent)) {
+                span.click();
+                window.__dismissedPopups.push(span.textContent);
+            }
+        }
+    };
+    // Coalesce bursts of DOM mutations into one scan.
+    window.__popupObserver = new MutationObserver(() => {
+        if (!scheduled) { scheduled = true; setTimeout(dismiss, 100); }
+    });
+    window.__popupObserver.observe(document.documentElement, { childList: true, subtree: true });
+})();
+""" % json.dumps(POPUP_LABELS)
+
+
+# Join-flow lookup done in-page with querySelector instead of an XPath text() scan: returns
+# the guest-name input if Meet shows one, true once a join button is up, else false.
+FIND_NAME_INPUT_SCRIPT = """
+const input = document.querySelector('input[aria-label="Your name"]');
+if (input) return input;
+for (const span of document.querySelectorAll('button span')) {
+    if (/Join now|Ask to join/.test(span.textContent)) return true;
+}
+return false;
+"""
+# Finds the visible, enabled join button and clicks it in-page, returning its label (or null),
+# so each poll of the join wait is a single WebDriver round trip.
+CLICK_JOIN_SCRIPT = """
+for (const span of document.querySelectorAll('button span')) {
+    const button = span.closest('button');
+    if (/Join now|Ask to join/.test(span.textContent) && !button.disabled && button.offsetParent !== null) {
+        button.click();
+        return span.textContent;
+    }
+}
+return null;
+"""
+
+def enter_guest_name(driver, display_name: str, timeout: float = 20) -> bool:
+    """
+    Type display_name into Meet's guest-name prompt and return True, or return False if no
+    prompt appears. Waits for whichever shows up first, the prompt or the join button, so
+    signed-in joins don't sit out the whole timeout.
+    """
+    try:
+        name_input = WebDriverWait(driver, timeout, poll_frequency=0.1).until(
+            lambda d: d.execute_script(FIND_NAME_INPUT_SCRIPT)
+        )
+        if name_input is True:
+            return False
+        name_input.clear()
+        name_input.send_keys(display_name)
+        return True
+    except WebDriverException:
+        return False
+
+def install_popup_dismisser(driver):
+    """Run the popup dismisser on every document loaded in this tab from now on."""
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": POPUP_DISMISS_SCRIPT})
@@ -0,0 +1,25 @@
+# utils/process_wait.py
+# Event-driven waits on child processes.
+import os
+import selectors
+import subprocess
+
+def wait_for_exit(proc: subprocess.Popen, timeout: float) -> bool:
+    """
+    Block until proc exits or timeout elapses, returning whether it exited.
+    Uses a pidfd where the kernel supports it so the wait is event-driven rather than polled.
+    """
+    try:
+        pidfd = os.pidfd_open(proc.pid)
+    except (AttributeError, OSError):
+        try:
+            proc.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(pidfd, selectors.EVENT_READ)
+            return bool(selector.select(timeout=timeout))
+    finally:
+        os.close(pidfd)
@@ -0,0 +1,24 @@
+# utils/pulse_audio.py
+# Checks whether PulseAudio is up by connecting to its socket instead of forking `pulseaudio --check`.
+import os
+import socket
+
+def pulse_socket_path() -> str:
+    """Return the PulseAudio native socket: PULSE_SERVER's unix: path, else the per-user runtime socket."""
+    server = os.environ.get("PULSE_SERVER", "")
+    if server.startswith("unix:"):
+        return server[len("unix:"):]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", f"/run/user/{os.getuid()}")
+    return os.path.join(runtime_dir, "pulse", "native")
+
+def pulseaudio_running() -> bool:
+    """Return whether a PulseAudio daemon accepts connections on its native socket."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Connect rather than test for the file: a crashed daemon leaves a stale socket behind.
+        sock.connect(pulse_socket_path())
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
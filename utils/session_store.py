@@ -1,42 +1,101 @@
 # utils/session_store.py
 # Provides a thread-safe in-memory store for tracking Selenium sessions.
+import asyncio
+import collections
+import json
+import os
+import socket
 import threading
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
 logger = logging.getLogger(__name__)
-sessions = {}
-sessions_lock = threading.Lock()
 
-def add_session(session_id: str, session_data: Dict[str, Any] = None) -> Dict[str, Any]:
-    """Adds a new session to the store."""
-    if session_data is None:
-        session_data = {}
-    
-    with sessions_lock:
-        sessions[session_id] = session_data
+# Stamped on sessions by the worker that creates them: with several workers sharing Redis, the
+# browser and recorder handles only exist in the process that started the session.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+class ShardedSessionStore:
+    """
+    Session dict split into shards, each with its own lock, so unrelated sessions never contend.
+    Writes are appended to a per-shard operation log without taking the lock and are applied
+    to the shard on the next read (or once the log grows past max_pending).
+    """
+
+    def __init__(self, num_shards: int = 16, max_pending: int = 100):
+        if num_shards < 1 or num_shards & (num_shards - 1):
+            raise ValueError("num_shards must be a power of two")
+        self._mask = num_shards - 1
+        self._max_pending = max_pending
+        self._shards = [{} for _ in range(num_shards)]
+        self._locks = [threading.RLock() for _ in range(num_shards)]
+        self._pending = [collections.deque() for _ in range(num_shards)]
+
+    def _index(self, session_id: str) -> int:
+        return hash(session_id) & self._mask
+
+    def _append(self, i: int, session_id: str, session_data: Dict[str, Any]):
+        # deque.append is atomic, so writers never block on the shard lock.
+        self._pending[i].append((session_id, session_data))
+        if len(self._pending[i]) > self._max_pending:
+            with self._locks[i]:
+                self._drain(i)
+
+    def _drain(self, i: int):
+        """Apply pending writes to shard i. Caller must hold the shard lock."""
+        pending = self._pending[i]
+        shard = self._shards[i]
+        while pending:
+            session_id, session_data = pending.popleft()
+            shard[session_id] = session_data
+
+    def flush(self):
+        """Apply all pending writes in every shard."""
+        for i, lock in enumerate(self._locks):
+            with lock:
+                self._drain(i)
+
+    def add_session(self, session_id: str, session_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Adds a new session to the store."""
+        if session_data is None:
+            session_data = {}
+
+        self._append(self._index(session_id), session_id, session_data)
         logger.info(f"Added session: {session_id}")
-    return session_data
+        return session_data
 
-def get_session(session_id: str) -> Optional[Dict[str, Any]]:
-    """Retrieves the session data for a given sessionId."""
-    with sessions_lock:
-        session = sessions.get(session_id)
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieves the session data for a given sessionId."""
+        i = self._index(session_id)
+        with self._locks[i]:
+            self._drain(i)
+            session = self._shards[i].get(session_id)
         if session is None:
             logger.debug(f"Session {session_id} not found.")
         return session
 
-def update_session(session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Update an existing session with new data. Creates the session if it doesn't exist."""
-    with sessions_lock:
-        sessions[session_id] = session_data
+    def update_session(self, session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Update an existing session with new data. Creates the session if it doesn't exist."""
+        self._append(self._index(session_id), session_id, session_data)
         logger.debug(f"Updated session: {session_id}")
-    return session_data
+        return session_data
 
-def remove_session(session_id: str) -> bool:
-    """Removes the session from the store."""
-    with sessions_lock:
-        removed = sessions.pop(session_id, None)
+    def patch_session(self, session_id: str, **fields) -> Dict[str, Any]:
+        """Set the given fields on a session in place, creating it if needed, under one lock."""
+        i = self._index(session_id)
+        with self._locks[i]:
+            self._drain(i)
+            session = self._shards[i].setdefault(session_id, {})
+            session.update(fields)
+        logger.debug(f"Patched session: {session_id}")
+        return session
+
+    def remove_session(self, session_id: str) -> bool:
+        """Removes the session from the store."""
+        i = self._index(session_id)
+        with self._locks[i]:
+            self._drain(i)
+            removed = self._shards[i].pop(session_id, None)
         if removed:
             logger.info(f"Removed session: {session_id}")
             return True
@@ -44,7 +103,219 @@ def remove_session(session_id: str) -> bool:
             logger.debug(f"Attempted to remove non-existent session: {session_id}")
             return False
 
+    def get_all_sessions(self) -> Dict[str, Dict[str, Any]]:
+        """Return a copy of all sessions."""
+        result = {}
+        for i, lock in enumerate(self._locks):
+            with lock:
+                self._drain(i)
+                result.update(self._shards[i])
+        return result
+
+    def set_status(self, session_id: str, status: str):
+        """Set the status field of an existing session."""
+        session = self.get_session(session_id)
+        if session is not None:
+            session["status"] = status
+
+class RedisSessionStore:
+    """
+    Session store shared across worker processes through Redis.
+    JSON-serializable session fields live in a Redis hash with a version counter that is bumped
+    with WATCH/MULTI/EXEC, so concurrent writers retry instead of clobbering each other.
+    Non-serializable values (drivers, Popen handles) stay in a process-local store.
+    """
+
+    # Handles to this process's browsers, recorders and audio modules. They are never written to
+    # Redis, so a refresh from another worker can't replace them with null.
+    PROCESS_LOCAL_KEYS = frozenset({
+        "driver", "ffmpeg_process", "recording_proc", "xvfb_proc", "headless_recorder",
+        "browser_recorder", "profile_dir", "sink_module",
+    })
+
+    def __init__(self, client, key_prefix: str = "session:", max_retries: int = 10):
+        self._redis = client
+        self._prefix = key_prefix
+        self._max_retries = max_retries
+        self._local = ShardedSessionStore()
+        # Last Redis version seen per session. Request threads, join executors and recording
+        # watchdogs all read and bump it, so it is only touched under _versions_lock.
+        self._versions: Dict[str, int] = {}
+        self._versions_lock = threading.Lock()
+
+    def _key(self, session_id: str) -> str:
+        return f"{self._prefix}{session_id}"
+
+    @classmethod
+    def _serialize(cls, session_data: Dict[str, Any]) -> Dict[str, str]:
+        fields = {}
+        for name, value in session_data.items():
+            if name in cls.PROCESS_LOCAL_KEYS:
+                continue
+            try:
+                fields[name] = json.dumps(value)
+            except (TypeError, ValueError):
+                continue  # process-local object
+        return fields
+
+    def _write(self, session_id: str, fields: Dict[str, str]):
+        """Compare-and-set the given fields, bumping the session version."""
+        import redis
+
+        key = self._key(session_id)
+        for _ in range(self._max_retries):
+            with self._redis.pipeline() as pipe:
+                try:
+                    pipe.watch(key)
+                    version = int(pipe.hget(key, "__version__") or 0) + 1
+                    pipe.multi()
+                    pipe.hset(key, mapping={**fields, "__version__": version})
+                    pipe.execute()
+                    with self._versions_lock:
+                        # Never move backwards past a newer version a concurrent reader applied.
+                        if version > self._versions.get(session_id, 0):
+                            self._versions[session_id] = version
+                    return
+                except redis.WatchError:
+                    continue
+        raise RuntimeError(f"Could not update session {session_id} after {self._max_retries} attempts")
+
+    def add_session(self, session_id: str, session_data: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Adds a new session to the store, owned by this worker."""
+        session_data = self._local.add_session(session_id, session_data)
+        session_data.setdefault("owner", WORKER_ID)
+        self._write(session_id, self._serialize(session_data))
+        return session_data
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Retrieves the session data, refreshing shared fields if another process changed them."""
+        remote = self._redis.hgetall(self._key(session_id))
+        if not remote:
+            # Removed (or never added) in Redis: drop any stale process-local copy.
+            with self._versions_lock:
+                stale = self._versions.pop(session_id, None) is not None
+            if stale:
+                self._local.remove_session(session_id)
+            return None
+        version = int(remote.pop(b"__version__", 0))
+        with self._versions_lock:
+            session = self._local.get_session(session_id)
+            if session is None:
+                session = self._local.add_session(session_id, {})
+            if version > self._versions.get(session_id, 0):
+                for name, value in remote.items():
+                    name = name.decode()
+                    if name not in self.PROCESS_LOCAL_KEYS:
+                        session[name] = json.loads(value)
+                self._versions[session_id] = version
+        return session
+
+    def update_session(self, session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Update an existing session with new data. Creates the session if it doesn't exist."""
+        self._local.update_session(session_id, session_data)
+        self._write(session_id, self._serialize(session_data))
+        return session_data
+
+    def patch_session(self, session_id: str, **fields) -> Dict[str, Any]:
+        """Set the given fields on a session, writing only those fields to Redis."""
+        session = self._local.patch_session(session_id, **fields)
+        shared = self._serialize(fields)
+        if shared:
+            self._write(session_id, shared)
+        return session
+
+    def remove_session(self, session_id: str) -> bool:
+        """Removes the session from the store."""
+        removed_local = self._local.remove_session(session_id)
+        removed_remote = self._redis.delete(self._key(session_id)) > 0
+        with self._versions_lock:
+            self._versions.pop(session_id, None)
+        return removed_local or removed_remote
+
+    def get_all_sessions(self) -> Dict[str, Dict[str, Any]]:
+        """Return a copy of all sessions across all processes."""
+        result = {}
+        for key in self._redis.scan_iter(match=f"{self._prefix}*"):
+            session_id = key.decode()[len(self._prefix):]
+            session = self.get_session(session_id)
+            if session is not None:
+                result[session_id] = session
+        return result
+
+    def set_status(self, session_id: str, status: str):
+        """Set the status field of an existing session."""
+        session = self.get_session(session_id)
+        if session is not None:
+            session["status"] = status
+            self._write(session_id, {"status": json.dumps(status)})
+
+def _create_store():
+    redis_url = os.environ.get("REDIS_URL")
+    if not redis_url:
+        return ShardedSessionStore()
+    import redis
+    logger.info(f"Using Redis session store at {redis_url}")
+    return RedisSessionStore(redis.Redis.from_url(redis_url))
+
+# Global instance for use throughout the application
+store = _create_store()
+
+def add_session(session_id: str, session_data: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Adds a new session to the store."""
+    return store.add_session(session_id, session_data)
+
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Retrieves the session data for a given sessionId."""
+    return store.get_session(session_id)
+
+def update_session(session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Update an existing session with new data. Creates the session if it doesn't exist."""
+    return store.update_session(session_id, session_data)
+
+def patch_session(session_id: str, **fields) -> Dict[str, Any]:
+    """Set only the given fields on a session instead of rewriting the whole dict."""
+    return store.patch_session(session_id, **fields)
+
+def remove_session(session_id: str) -> bool:
+    """Removes the session from the store."""
+    return store.remove_session(session_id)
+
+def is_owned_here(session: Dict[str, Any]) -> bool:
+    """True if the session's driver and recorder handles live in this worker process."""
+    return session.get("owner", WORKER_ID) == WORKER_ID
+
 def get_all_sessions() -> Dict[str, Dict[str, Any]]:
     """Return a copy of all sessions."""
-    with sessions_lock:
-        return sessions.copy()
+    return store.get_all_sessions()
+
+# Status subscribers: session_id -> [(event loop, queue)]. Bots update status from worker
+# threads, so notifications are handed to each subscriber's loop thread-safely.
+_status_subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+_subscribers_lock = threading.Lock()
+
+def subscribe_status(session_id: str) -> asyncio.Queue:
+    """Return a queue that receives every status set for the session. Must be called from a running event loop."""
+    status_queue = asyncio.Queue()
+    with _subscribers_lock:
+        _status_subscribers.setdefault(session_id, []).append((asyncio.get_running_loop(), status_queue))
+    return status_queue
+
+def unsubscribe_status(session_id: str, status_queue: asyncio.Queue):
+    """Stop delivering status updates to the given queue."""
+    with _subscribers_lock:
+        subscribers = _status_subscribers.get(session_id, [])
+        subscribers[:] = [(loop, q) for loop, q in subscribers if q is not status_queue]
+        if not subscribers:
+            _status_subscribers.pop(session_id, None)
+
+def set_status(session_id: str, status: str):
+    """Set the session status and push it to any status subscribers."""
+    store.set_status(session_id, status)
+    with _subscribers_lock:
+        subscribers = list(_status_subscribers.get(session_id, []))
+    for loop, status_queue in subscribers:
+        try:
+            loop.call_soon_threadsafe(status_queue.put_nowait, status)
+        except RuntimeError:
+            # The subscriber's loop has already been closed.
+            pass
@@ -0,0 +1,127 @@
+# utils/video_encoder.py
+# Picks the H.264 encoder ffmpeg should use for recordings, preferring hardware encoders,
+# and holds the capture input options shared by every recorder.
+import functools
+import logging
+import os
+import subprocess
+import threading
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# Candidate encoders in order of preference; libx264 is the software fallback.
+HARDWARE_ENCODERS = ["h264_nvenc", "h264_qsv", "h264_videotoolbox", "h264_vaapi"]
+
+# Software encoder threads: half the CPUs by default so x264 can't starve Chrome and Xvfb.
+ENCODER_THREADS = int(os.environ.get("FFMPEG_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+
+# Optional output size (e.g. "960x540") to encode at instead of the captured size; encode
+# cost scales with pixel count. Unset keeps the capture resolution.
+ENCODE_RESOLUTION = os.environ.get("ENCODE_RESOLUTION", "").lower()
+
+# Live-capture input options: a deep thread queue absorbs CPU spikes (e.g. Chrome scrolling)
+# instead of dropping packets, and PulseAudio is stamped with wall-clock time so audio
+# doesn't drift from the x11grab video.
+X11GRAB_INPUT_ARGS = ["-thread_queue_size", "512", "-fflags", "nobuffer"]
+PULSE_INPUT_ARGS = ["-thread_queue_size", "512", "-fflags", "nobuffer", "-use_wallclock_as_timestamps", "1"]
+
+# Meeting audio is speech: mono AAC at 64k is transparent for voice at half the bytes of
+# 128k stereo. AAC rather than Opus keeps the MP4s playable everywhere they're uploaded to.
+AUDIO_ENCODER_ARGS = ["-c:a", "aac", "-b:a", "64k", "-ac", "1"]
+
+def video_encoder_args(vcodec: str) -> Tuple[List[str], List[str]]:
+    """
+    Return (input_args, output_args) for the given ffmpeg video encoder.
+    input_args go before the first -i, output_args replace the -c:v block.
+    """
+    width, _, height = ENCODE_RESOLUTION.partition("x")
+    if vcodec == "h264_vaapi":
+        input_args = ["-vaapi_device", VAAPI_DEVICE]
+        # Upload x11grab's BGR0 frames as-is and convert (and scale) to NV12 on the GPU, not per
+        # pixel on the CPU.
+        size = f"w={width}:h={height}:" if height else ""
+        output_args = ["-vf", f"hwupload,scale_vaapi={size}format=nv12", "-c:v", "h264_vaapi", "-qp", "23"]
+    elif vcodec == "h264_nvenc":
+        input_args = []
+        output_args = ["-c:v", "h264_nvenc", "-preset", "p1", "-tune", "ll", "-rc", "cbr", "-b:v", "2500k"]
+    elif vcodec == "h264_qsv":
+        input_args = []
+        output_args = ["-pix_fmt", "nv12", "-c:v", "h264_qsv", "-preset", "veryfast", "-b:v", "2500k"]
+    elif vcodec == "h264_videotoolbox":
+        input_args = []
+        output_args = ["-c:v", "h264_videotoolbox", "-realtime", "1", "-b:v", "2500k"]
+    else:
+        input_args = []
+        # Screencasts gain nothing from lookahead, scenecut detection or extra reference frames,
+        # so strip x264 down to its cheapest per-frame path.
+        output_args = [
+            "-c:v", vcodec, "-preset", "ultrafast", "-tune", "zerolatency",
+            "-x264-params", "sliced-threads=1:sync-lookahead=0:rc-lookahead=0:ref=1:scenecut=0",
+            "-threads", str(ENCODER_THREADS), "-pix_fmt", "yuv420p"
+        ]
+    if height and vcodec != "h264_vaapi":
+        output_args = ["-vf", f"scale={width}:{height}:flags=fast_bilinear"] + output_args
+    # Short GOP and no B-frames keep encoder buffering and reordering latency low.
+    return input_args, output_args + ["-g", "60", "-bf", "0"]
+
+def log_ffmpeg_stderr(proc: subprocess.Popen, log: logging.Logger, label: str = "ffmpeg") -> threading.Thread:
+    """
+    Forward a recorder's stderr pipe to log from a daemon thread. An unread pipe fills after
+    64KB and ffmpeg then blocks on the write, freezing the recording mid-meeting.
+    The thread takes ownership of the pipe, so proc.communicate() no longer reads stderr.
+    """
+    stream, proc.stderr = proc.stderr, None
+
+    def _drain():
+        with stream:
+            for line in iter(stream.readline, b""):
+                log.info(f"{label}: {line.decode(errors='replace').rstrip()}")
+
+    thread = threading.Thread(target=_drain, name=f"{label}-stderr", daemon=True)
+    thread.start()
+    return thread
+
+def _encoder_works(vcodec: str) -> bool:
+    """Encode a few blank frames with the encoder to confirm the hardware is actually usable."""
+    input_args, output_args = video_encoder_args(vcodec)
+    cmd = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error", *input_args,
+        "-f", "lavfi", "-i", "nullsrc=s=256x256:d=0.2",
+        *output_args, "-f", "null", "-"
+    ]
+    try:
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+@functools.lru_cache(maxsize=1)
+def pick_video_encoder() -> str:
+    """
+    Return the ffmpeg video encoder to use, probed once per process.
+    RECORDER_VCODEC overrides the probe; otherwise the first working hardware encoder wins.
+    """
+    override = os.environ.get("RECORDER_VCODEC")
+    if override:
+        return override
+
+    try:
+        result = subprocess.run(
+            ["ffmpeg", "-hide_banner", "-encoders"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, timeout=10
+        )
+        available = result.stdout
+    except (OSError, subprocess.TimeoutExpired):
+        available = ""
+
+    for vcodec in HARDWARE_ENCODERS:
+        if vcodec == "h264_vaapi" and not os.path.exists(VAAPI_DEVICE):
+            continue
+        if vcodec in available and _encoder_works(vcodec):
+            logger.info(f"Using hardware video encoder {vcodec}.")
+            return vcodec
+
+    logger.info("No hardware video encoder available; using libx264.")
+    return "libx264"